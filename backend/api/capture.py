@@ -0,0 +1,133 @@
+"""Traffic capture module for offline capacity planning.
+
+When TRAFFIC_CAPTURE_PATH is set, every API request and every Spotify call is appended to that
+file as a JSON line, to be replayed later by tools/replay.py against tools/fake_spotify.py.
+Access tokens, visitor IDs and Spotify user IDs are replaced with stable pseudonyms, and only the
+response fields replay needs are kept, so captures hold no credentials or profile data.
+"""
+import hashlib
+import json
+import threading
+import time
+import urllib.parse
+import flask
+import requests
+import config
+
+# Path parameters holding secrets or visitor identities, replaced with pseudonyms
+SECRET_PARAMS = ('spotify_access_token', 'token', 'fpjs_visitor_id')
+
+# Endpoints whose responses map captured IDs to the IDs created during replay
+RESPONSE_ENDPOINTS = ('create_queue', 'add_song_to_queue', 'apply_batch')
+
+# Queue song fields replay needs to find the ID of an added song
+REPLAY_SONG_FIELDS = ('id', 'spotify_track_id', 'added_on_utc')
+
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """Check whether traffic capture is enabled.
+
+    :return: True if TRAFFIC_CAPTURE_PATH is set
+    """
+    return bool(config.TRAFFIC_CAPTURE_PATH)
+
+
+def pseudonymize(secret: str) -> str:
+    """Replace a secret with a stable pseudonym.
+
+    :param secret: secret value, e.g. a Spotify access token
+    :return: pseudonym that is the same for the same secret
+    """
+    return 'captured-' + hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def record_request(endpoint_name: str, response: dict, status_code: int,
+                   duration_seconds: float) -> None:
+    """Record the current API request.
+
+    :param endpoint_name: name of endpoint function
+    :param response: request response
+    :param status_code: response status code
+    :param duration_seconds: time taken to handle the request
+    """
+    path_args = {
+        key: (pseudonymize(value) if key in SECRET_PARAMS else value)
+        for key, value in (flask.request.view_args or {}).items() if key != 'endpoint_func'}
+    _write({
+        'kind': 'request',
+        'ts': time.time(),
+        'endpoint': endpoint_name,
+        'method': flask.request.method,
+        'rule': flask.request.url_rule.rule,
+        'path_args': path_args,
+        'query_args': flask.request.args.to_dict(),
+        'body': flask.request.get_json(silent=True),
+        'status_code': status_code,
+        'duration_ms': duration_seconds * 1000,
+        'response': _replay_ids(response) if endpoint_name in RESPONSE_ENDPOINTS else None})
+
+
+def record_spotify_call(method: str, url: str, access_token: str, resp: requests.Response,
+                        duration_seconds: float) -> None:
+    """Record a Spotify API call.
+
+    :param method: request HTTP method
+    :param url: request URL
+    :param access_token: Spotify API access token
+    :param resp: Spotify response
+    :param duration_seconds: time taken by the call
+    """
+    parsed_url = urllib.parse.urlparse(url)
+    try:
+        body = resp.json()
+    except ValueError:
+        body = None
+    if parsed_url.path == '/v1/me' and isinstance(body, dict):
+        # Keep only the pseudonymized user ID, dropping profile data like email
+        body = {'id': pseudonymize(body['id']) if body.get('id') else None}
+    _write({
+        'kind': 'spotify',
+        'ts': time.time(),
+        'method': method,
+        'path': parsed_url.path,
+        'query': parsed_url.query,
+        'token': pseudonymize(access_token),
+        'status_code': resp.status_code,
+        'duration_ms': duration_seconds * 1000,
+        'body': body})
+
+
+def _replay_ids(response: dict) -> dict:
+    """Strip a response down to the IDs replay maps onto the IDs it creates.
+
+    Full queue responses hold host and subscriber access tokens, which must never be captured.
+
+    :param response: request response
+    :return: dict with error message, queue ID and name, and added song IDs, where present
+    """
+    replay_ids: dict = {
+        key: response[key] for key in ('error_message', 'id', 'name') if key in response}
+    if isinstance(response.get('queue_song'), dict):
+        replay_ids['queue_song'] = {'id': response['queue_song'].get('id')}
+    for key in ('queued_songs', 'played_songs'):
+        if key in response:
+            replay_ids[key] = [
+                {field: song.get(field) for field in REPLAY_SONG_FIELDS}
+                for song in response[key]]
+    if 'results' in response:
+        replay_ids['results'] = [
+            {'queue_song_id': result.get('queue_song_id')} for result in response['results']]
+    return replay_ids
+
+
+def _write(event: dict) -> None:
+    """Append an event to the capture file.
+
+    :param event: JSON serializable event
+    """
+    line = json.dumps(event, default=str) + '\n'
+    with _lock:
+        with open(config.TRAFFIC_CAPTURE_PATH, 'a', encoding='utf-8') as capture_file:
+            capture_file.write(line)
@@ -1,93 +1,183 @@
 """Queue Manager API controller module."""
 import datetime
-import time
 import config
+from api import outbox
+from api import payments
+from api import ratelimit
 from api import spotify
+from api import utils
+from db import connection
 from db import models
+from db import querybudget
 
+# Max boost payment intents to cancel on Stripe per manager run
+STALE_BOOST_PAYMENTS_PER_RUN = 100
 
+
+@querybudget.query_budget(config.SQL_MANAGER_QUERY_BUDGET, duplicate_threshold=None)
 def manage_active_queues(token: str) -> dict:
     """Manages active Mixify queues and Spotify playback.
 
-    Runs once per minute globally.
+    Runs once per minute globally. Stages top songs in each host's Spotify queue until at least
+    MANAGER_LOOKAHEAD_SONGS are staged and they cover playback until the next run.
 
-    :return: dict with songs added to Spotify queues, if any
+    :return: dict of queue names to lists of songs added to Spotify queues, if any
     :raises RuntimeError: if manager token is invalid
     """
     if token != config.QUEUE_MANAGER_TOKEN:
         raise RuntimeError('invalid manager token')
+    with ratelimit.background_priority():
+        return _manage_active_queues()
+
+
+def _manage_active_queues() -> dict:
+    """Manage active Mixify queues at background Spotify priority.
+
+    :return: dict of queue names to lists of songs added to Spotify queues, if any
+    """
     songs_queued_on_spotify = {}
-    for active_queue in models.Queues.query.filter_by(ended_on_utc=None, paused_on_utc=None).all():
-        active_queue_songs = models.QueueSongs.query.filter_by(queue_id=active_queue.id).all()
-        unplayed_queue_songs = [
-            queue_song for queue_song in active_queue_songs
-            if (queue_song.added_to_spotify_queue_on_utc is None
-                and queue_song.played_on_utc is None)]
-        if len(unplayed_queue_songs) == 0:
-            continue  # no songs to queue, skip
-
-        # Fetch current queue and song playing
-        track_ids_in_spotify_queue = []
-        current_playing_track_id: str | None = None
-        try:
-            playback_info = spotify.get_playback_info(active_queue.spotify_access_token)
-            track_ids_in_spotify_queue = playback_info['queue']
-            current_playing_track_id = playback_info['current_track']
-        except Exception:  # pylint: disable=broad-except
-            continue  # access token expired
-
-        # Determine the unplayed song last added to the Spotify queue by Mixify
-        last_queued_track_id: str | None = None
-        last_queued_on: datetime.datetime | None = None
-        for queue_song in active_queue_songs:
-            if (current_playing_track_id and queue_song.spotify_track_id == current_playing_track_id
-                    and queue_song.added_to_spotify_queue_on_utc is not None):
-                queue_song.played_on_utc = datetime.datetime.utcnow()
-                queue_song.save()
-            if queue_song.added_to_spotify_queue_on_utc is None:
-                continue  # not queued yet, skip
-            if queue_song.played_on_utc is not None:
-                continue  # already played, skip
-            if last_queued_on is None or queue_song.added_to_spotify_queue_on_utc > last_queued_on:
-                last_queued_track_id = queue_song.spotify_track_id
-                last_queued_on = queue_song.added_to_spotify_queue_on_utc
-
-        # Skip if Mixify song is in the Spotify queue
-        if last_queued_track_id in track_ids_in_spotify_queue:
-            continue
-
-        # Determine the song at the top of the Mixify queue
-        top_song: models.QueueSongs | None = None
-        top_song_upvotes = -1
-        for song in unplayed_queue_songs:
-            song_upvotes = len(models.QueueSongUpvotes.query.filter_by(queue_song_id=song.id).all())
-            if song_upvotes > top_song_upvotes or (
-                    song_upvotes == top_song_upvotes
-                    and song.added_on_utc < top_song.added_on_utc):
-                top_song = song
-                top_song_upvotes = song_upvotes
-
-        # Add the next song to Spotify queue
-        time.sleep(0.1)  # throttle to avoid rate limit
-        try:
-            spotify.add_to_queue(active_queue.spotify_access_token, top_song.spotify_track_uri)
-        except Exception:  # pylint: disable=broad-except
-            pass  # host has no devices active
-        else:
-            top_song.added_to_spotify_queue_on_utc = datetime.datetime.utcnow()
-            top_song.save()
-            songs_queued_on_spotify[active_queue.name] = top_song.name
-
-        # Add the next song to all subscribers Spotify queues
-        for subscriber in models.QueueSubscribers.query.filter_by(queue_id=active_queue.id).all():
-            if active_queue.spotify_access_token == subscriber.spotify_access_token:
-                continue  # subcriber is host, skip
-            time.sleep(0.1)  # throttle to avoid rate limit
-            try:
-                spotify.add_to_queue(subscriber.spotify_access_token, top_song.spotify_track_uri)
-            except Exception:  # pylint: disable=broad-except
-                pass  # Subscriber has no devices active.
+    for active_queue in models.Queues.query.filter_by(
+            ended_on_utc=None, paused_on_utc=None, suspended_on_utc=None).all():
+        if not utils.spotify_calls_allowed(active_queue):
+            continue  # backing off after access token failures, skip
+        with querybudget.track(f'manager_tick:{active_queue.name}'):
+            staged_song_names = _manage_queue(active_queue)
+        if staged_song_names:
+            songs_queued_on_spotify[active_queue.name] = staged_song_names
+
+    outbox.drain()  # send staged songs to Spotify
+    outbox.prune()
+    _cancel_stale_boost_payments()
 
     print({'queued_songs': songs_queued_on_spotify})  # easy debugging :)
 
     return songs_queued_on_spotify
+
+
+def _manage_queue(active_queue: models.Queues) -> list[str]:
+    """Manage playback of a single active Mixify queue.
+
+    :param active_queue: Mixify queue object
+    :return: names of songs staged for the Spotify queue, if any
+    """
+    staged_song_names: list[str] = []
+    active_queue_songs = models.QueueSongs.query.filter_by(queue_id=active_queue.id).all()
+    unplayed_queue_songs = [
+        queue_song for queue_song in active_queue_songs
+        if (queue_song.added_to_spotify_queue_on_utc is None
+            and queue_song.played_on_utc is None)]
+    if len(unplayed_queue_songs) == 0:
+        return []  # no songs to queue, skip
+
+    # Fetch current queue and song playing
+    track_ids_in_spotify_queue = []
+    current_playing_track_id: str | None = None
+    try:
+        playback_info = spotify.get_playback_info(active_queue.spotify_access_token)
+        track_ids_in_spotify_queue = (
+            playback_info['queue'] + utils.get_pending_spotify_track_ids(active_queue))
+        current_playing_track_id = playback_info['current_track']
+    except spotify.AccessTokenError:
+        utils.record_spotify_token_failure(active_queue)
+        return []  # access token expired
+    except Exception:  # pylint: disable=broad-except
+        return []  # Spotify unavailable, retry next run
+    utils.reset_spotify_token_failures(active_queue)
+
+    # Flag the Mixify song currently playing as played
+    for queue_song in active_queue_songs:
+        if (current_playing_track_id and queue_song.spotify_track_id == current_playing_track_id
+                and queue_song.added_to_spotify_queue_on_utc is not None
+                and queue_song.played_on_utc is None):
+            utils.mark_queue_song_played(active_queue, queue_song, datetime.datetime.utcnow())
+
+    # Measure the Mixify songs staged ahead of playback in the Spotify queue or outbox, and only
+    # stage as many songs as MANAGER_LOOKAHEAD_SONGS and playback until the next run require
+    unattributed_track_ids = list(track_ids_in_spotify_queue)
+    staged_count = 0
+    staged_duration_ms = 0
+    for queue_song in active_queue_songs:
+        if queue_song.added_to_spotify_queue_on_utc is None:
+            continue  # not queued yet, skip
+        if queue_song.played_on_utc is not None:
+            continue  # already played, skip
+        if queue_song.spotify_track_id not in unattributed_track_ids:
+            continue  # skipped or played between runs, skip
+        unattributed_track_ids.remove(queue_song.spotify_track_id)  # attribute once
+        staged_count += 1
+        staged_duration_ms += queue_song.duration_ms
+
+    # Stage top songs of the Mixify queue until the lookahead is filled and playback
+    # is covered until the next run
+    upvote_counts: dict = dict(connection.SQL.session.query(  # pylint: disable=no-member
+        models.QueueSongUpvotes.queue_song_id,
+        connection.SQL.func.count(models.QueueSongUpvotes.id)).filter(
+            models.QueueSongUpvotes.queue_song_id.in_(
+                [song.id for song in unplayed_queue_songs])).group_by(
+                    models.QueueSongUpvotes.queue_song_id).all())
+
+    # Boosted songs only wait here if the outbox gave up sending them, so they go first
+    boosted_queue_song_ids = {
+        queue_song_boost.queue_song_id for queue_song_boost in
+        models.QueueSongBoosts.query.filter_by(queue_id=active_queue.id).all()}
+    unplayed_queue_songs.sort(key=lambda song: (
+        song.id not in boosted_queue_song_ids,
+        -upvote_counts.get(song.id, 0),
+        song.added_on_utc))
+    for top_song in unplayed_queue_songs:
+        if (staged_count >= config.MANAGER_LOOKAHEAD_SONGS
+                and staged_duration_ms >= config.MANAGER_INTERVAL_SECONDS * 1000):
+            break
+
+        # Stage the song for the Spotify queues of the host and all subscribers
+        top_song.added_to_spotify_queue_on_utc = datetime.datetime.utcnow()
+        top_song.save(commit=False)
+        outbox.enqueue_queue_song(top_song)
+        utils.close_boost_payment_intents(top_song)
+        utils.bump_queue_version(active_queue)
+        staged_song_names.append(top_song.name)
+        staged_count += 1
+        staged_duration_ms += top_song.duration_ms
+
+    return staged_song_names
+
+
+def _cancel_stale_boost_payments() -> None:
+    """Cancel closed or expired boost payment intents on Stripe.
+
+    Intents are left alone for BOOST_PAYMENT_CANCEL_GRACE_MINUTES after closing or expiring, so
+    visitors who started paying just before can finish, and while their payment is processing.
+    """
+    current_utc = datetime.datetime.utcnow()
+    grace_cutoff = current_utc - datetime.timedelta(
+        minutes=config.BOOST_PAYMENT_CANCEL_GRACE_MINUTES)
+    for payment_intent in models.BoostPaymentIntents.query.filter(
+            models.BoostPaymentIntents.stripe_canceled_on_utc.is_(None),
+            models.BoostPaymentIntents.used_on_utc.is_(None),
+            connection.SQL.or_(
+                models.BoostPaymentIntents.canceled_on_utc <= grace_cutoff,
+                models.BoostPaymentIntents.expires_on_utc <= grace_cutoff)).limit(
+                    STALE_BOOST_PAYMENTS_PER_RUN).all():
+        try:
+            if not payments.cancel_boost_payment(payment_intent.stripe_payment_intent_id):
+                continue  # payment processing, retry next run
+        except Exception:  # pylint: disable=broad-except
+            pass  # intent already succeeded or canceled
+        payment_intent.canceled_on_utc = payment_intent.canceled_on_utc or current_utc
+        payment_intent.stripe_canceled_on_utc = current_utc  # attempted, never retry
+        payment_intent.save()
+
+
+@querybudget.query_budget(config.SQL_MANAGER_QUERY_BUDGET, duplicate_threshold=None)
+def drain_spotify_outbox(token: str) -> dict:
+    """Sends pending Spotify queue writes from the outbox.
+
+    Can run more often than the queue manager to retry failed writes sooner.
+
+    :return: dict with number of writes sent
+    :raises RuntimeError: if manager token is invalid
+    """
+    if token != config.QUEUE_MANAGER_TOKEN:
+        raise RuntimeError('invalid manager token')
+    with ratelimit.background_priority():
+        return {'sent_count': outbox.drain()}
@@ -1,11 +1,16 @@
 """Queue API controller module."""
 import datetime
 import config
+from api import outbox
 from api import payments
 from api import spotify
 from api import utils
+from db import connection
 from db import models
 
+# Number of contributors listed in queue stats
+TOP_CONTRIBUTORS = 5
+
 
 def fetch_queue(queue_name: str, fpjs_visitor_id: str) -> dict:
     """Fetch a Mixify queue.
@@ -41,6 +46,7 @@ def create_queue(spotify_access_token: str, fpjs_visitor_id: str) -> dict:
     if active_queue is not None:
         active_queue.spotify_access_token = spotify_access_token  # refresh access token
         active_queue.started_by_fpjs_visitor_id = fpjs_visitor_id  # refresh ownership
+        utils.reset_spotify_token_failures(active_queue, commit=False)  # lift suspension
         active_queue.save()
         return active_queue.as_dict()
 
@@ -54,15 +60,21 @@ def create_queue(spotify_access_token: str, fpjs_visitor_id: str) -> dict:
         spotify_user_id=user['id'],
         spotify_access_token=spotify_access_token,
         started_by_fpjs_visitor_id=fpjs_visitor_id,
-        started_on_utc=datetime.datetime.utcnow()).save()
+        started_on_utc=datetime.datetime.utcnow())
+    utils.record_queue_started(new_queue)
+    new_queue.save()
     return new_queue.as_dict()
 
 
-def search_tracks(queue_id: str, search_query: str) -> dict:
-    """Search Spotify for a track.
+def search_tracks(queue_id: str, search_query: str, local_only: bool = False) -> dict:
+    """Search for a track, leading with tracks previously added to any Mixify queue.
+
+    Local results fill at most half the results unless Spotify returns too few, or Spotify is
+    skipped or unavailable for the queue.
 
     :param queue_id: ID of queue to search for
     :param search_query: query to use for search
+    :param local_only: skip Spotify and search previously queued tracks only, defaults to False
     :raises RuntimeError: if queue ID is invalid
     :return: list of tracks (search results)
     """
@@ -70,10 +82,20 @@ def search_tracks(queue_id: str, search_query: str) -> dict:
     if queue is None:
         raise RuntimeError('queue not found')
 
-    search_results_info: list[dict] = []
-    for index, result in enumerate(spotify.search(queue.spotify_access_token, search_query)):
-        if index == config.MAX_SEARCH_RESULTS:
+    known_tracks_info = utils.search_known_tracks(search_query, config.MAX_SEARCH_RESULTS)
+    if local_only or queue.suspended_on_utc is not None:
+        return known_tracks_info  # Spotify search skipped or unavailable
+
+    # Lead with local results, capped at half the results so fuzzy local matches on common words
+    # never hide new tracks on Spotify
+    search_results_info = known_tracks_info[:config.MAX_SEARCH_RESULTS // 2]
+    found_track_ids = {result['track_id'] for result in search_results_info}
+    for result in spotify.search(queue.spotify_access_token, search_query):
+        if len(search_results_info) == config.MAX_SEARCH_RESULTS:
             break
+        if result['id'] in found_track_ids:
+            continue  # already found locally, skip
+        found_track_ids.add(result['id'])
         search_results_info.append({
             'track_id': result['id'],
             'track_name': result['name'],
@@ -82,100 +104,142 @@ def search_tracks(queue_id: str, search_query: str) -> dict:
             'track_length': result['duration_ms'],
             'track_explicit': result['explicit']})
 
+    # Fill any remaining results with the rest of the local results
+    for result in known_tracks_info[config.MAX_SEARCH_RESULTS // 2:]:
+        if len(search_results_info) == config.MAX_SEARCH_RESULTS:
+            break
+        if result['track_id'] not in found_track_ids:
+            found_track_ids.add(result['track_id'])
+            search_results_info.append(result)
+
     return search_results_info
 
 
-def add_song_to_queue(queue_id: str, spotify_track_id: str, fpjs_visitor_id: str) -> dict:
+def add_song_to_queue(queue_id: str, spotify_track_id: str, fpjs_visitor_id: str,
+                      compact: bool = False) -> dict:
     """Add a song from Spotify to a Mixify queue.
 
     :param queue_id: ID of Mixify queue
     :param spotify_track_id: Track ID of song on Spotify
     :param fpjs_visitor_id: FingerprintJS ID of user who added track
+    :param compact: return only the added song, its rank and queue version, defaults to False
     :raises RuntimeError: if queue ID or track ID is invalid, or queue has been ended
     :return: updated queue object with track added
     """
-    queue: models.Queues = models.Queues.query.filter_by(id=queue_id).first()
-    if queue is None:
-        raise RuntimeError('queue not found')
-    if queue.ended_on_utc is not None:
-        raise RuntimeError('queue is ended')
-    if models.QueueSongs.query.filter_by(
-            queue_id=queue_id, spotify_track_id=spotify_track_id,
-            added_to_spotify_queue_on_utc=None).first() is not None:
-        raise RuntimeError('song already in queue')
-    track_info = spotify.get_track(queue.spotify_access_token, spotify_track_id)
-    if 'id' not in track_info or track_info['id'] is None:
-        raise RuntimeError('Spotify track not found')
-
-    queue_track: models.QueueSongs = models.QueueSongs(
-        queue_id=queue_id,
-        name=track_info['name'],
-        artist=', '.join([artist['name'] for artist in track_info['artists']]),
-        album_cover_url=track_info['album']['images'][0]['url'],
-        duration_ms=track_info['duration_ms'],
-        spotify_track_id=spotify_track_id,
-        spotify_track_uri=track_info['uri'],
-        added_by_fpjs_visitor_id=fpjs_visitor_id,
-        added_on_utc=datetime.datetime.utcnow()).save()
+    queue = _get_open_queue(queue_id)
+    track_info = _fetch_track_info(queue, spotify_track_id)
+    queue_track = _add_song_to_queue(queue, spotify_track_id, track_info, fpjs_visitor_id)
+    utils.bump_queue_version(queue)
 
+    if compact:
+        return utils.get_queue_song_ack(queue_track, fpjs_visitor_id)
     return utils.get_queue_with_tracks(queue_track.queue, fpjs_visitor_id)
 
 
-def upvote_song(queue_song_id: str, fpjs_visitor_id: str) -> dict:
+def upvote_song(queue_song_id: str, fpjs_visitor_id: str, compact: bool = False) -> dict:
     """Upvote an unplayed song in a Mixify queue.
 
     :param queue_song_id: queue song ID
     :param fpjs_visitor_id: FingerprintJS visitor ID
+    :param compact: return only the upvoted song, its rank and queue version, defaults to False
     :raises RuntimeError: if queue song ID is invalid or already queued on Spotify
     :return: updated queue with new upvote
     """
-    queue_song: models.QueueSongs = models.QueueSongs.query.filter_by(id=queue_song_id).first()
-    if queue_song is None:
-        raise RuntimeError('queue song not found')
-    if queue_song.added_to_spotify_queue_on_utc is not None:
-        raise RuntimeError('song already queued on Spotify')
-    current_utc = datetime.datetime.utcnow()
-
-    models.QueueSongUpvotes(
-        queue_song_id=queue_song_id,
-        upvoted_by_fpjs_visitor_id=fpjs_visitor_id,
-        upvoted_on_utc=current_utc).save()
-
-    # Flag first like for queue ordering
-    if queue_song.first_liked_on_utc is None:
-        queue_song.first_liked_on_utc = current_utc
-        queue_song.save()
+    queue_song = _get_unqueued_song(queue_song_id)
+    _upvote_song(queue_song, fpjs_visitor_id)
+    utils.bump_queue_version(queue_song.queue)
 
+    if compact:
+        return utils.get_queue_song_ack(queue_song, fpjs_visitor_id)
     return utils.get_queue_with_tracks(queue_song.queue, fpjs_visitor_id)
 
 
-def remove_song_upvote(queue_song_id: str, fpjs_visitor_id: str) -> dict:
+def remove_song_upvote(queue_song_id: str, fpjs_visitor_id: str, compact: bool = False) -> dict:
     """Remove an upvote on an unplayed song in a Mixify queue.
 
     :param queue_song_id: queue song ID
     :param fpjs_visitor_id: FingerprintJS visitor ID
+    :param compact: return only the unvoted song, its rank and queue version, defaults to False
     :raises RuntimeError: if queue song ID is invalid or already queued on Spotify
     :return: updated queue with upvote removed
     """
-    queue_song: models.QueueSongs = models.QueueSongs.query.filter_by(id=queue_song_id).first()
-    if queue_song is None:
-        raise RuntimeError('queue song not found')
-    if queue_song.added_to_spotify_queue_on_utc is not None:
-        raise RuntimeError('song already queued on Spotify')
+    queue_song = _get_unqueued_song(queue_song_id)
+    _remove_song_upvote(queue_song, fpjs_visitor_id)
+    utils.bump_queue_version(queue_song.queue)
 
-    queue_song_upvote: models.QueueSongUpvotes = models.QueueSongUpvotes.query.filter_by(
-        queue_song_id=queue_song.id, upvoted_by_fpjs_visitor_id=fpjs_visitor_id).first()
-    if queue_song_upvote is None:
-        raise RuntimeError('queue song upvote not found')
-    queue_song_upvote.delete()
+    if compact:
+        return utils.get_queue_song_ack(queue_song, fpjs_visitor_id)
+    return utils.get_queue_with_tracks(queue_song.queue, fpjs_visitor_id)
 
-    # Remove first liked flag if song has no upvotes now
-    if len(models.QueueSongUpvotes.query.filter_by(
-            queue_song_id=queue_song.id).all()) == 0:
-        queue_song.first_liked_on_utc = None
-    queue_song.save()
 
-    return utils.get_queue_with_tracks(queue_song.queue, fpjs_visitor_id)
+def apply_batch(queue_id: str, fpjs_visitor_id: str, operations: list[dict]) -> dict:
+    """Apply a batch of upvote, unvote and add operations to a Mixify queue.
+
+    Added tracks are fetched from Spotify first, then operations are applied in order within a
+    single transaction. Each operation runs in its own savepoint, so a failed operation is rolled
+    back without affecting the others.
+
+    :param queue_id: ID of Mixify queue
+    :param fpjs_visitor_id: FingerprintJS visitor ID
+    :param operations: list of dicts with `type` (`upvote`, `unvote` or `add`) and either
+        `queue_song_id` or `spotify_track_id`
+    :raises RuntimeError: if queue ID is invalid, queue has been ended or batch is too large
+    :return: dict with per-operation results and updated queue
+    """
+    queue = _get_open_queue(queue_id)
+    if len(operations) > config.MAX_BATCH_OPERATIONS:
+        raise RuntimeError(f'batch exceeds {config.MAX_BATCH_OPERATIONS} operations')
+
+    # Fetch added tracks from Spotify before writing, so no row locks are held while waiting on
+    # Spotify or its rate limit
+    track_infos: dict[str, dict | Exception] = {}
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('type') != 'add':
+            continue
+        spotify_track_id = operation.get('spotify_track_id')
+        if not isinstance(spotify_track_id, str) or spotify_track_id in track_infos:
+            continue  # invalid or already fetched, skip
+        try:
+            track_infos[spotify_track_id] = _fetch_track_info(queue, spotify_track_id)
+        except Exception as error:  # pylint: disable=broad-except
+            track_infos[spotify_track_id] = error
+
+    results: list[dict] = []
+    for operation in operations:
+        result: dict = {'type': operation.get('type') if isinstance(operation, dict) else None}
+        try:
+            with connection.SQL.session.begin_nested():  # pylint: disable=no-member
+                if operation.get('type') == 'add':
+                    spotify_track_id = operation.get('spotify_track_id')
+                    track_info = (track_infos.get(spotify_track_id)
+                                  if isinstance(spotify_track_id, str) else None)
+                    if track_info is None:
+                        raise RuntimeError('Spotify track not found')
+                    if isinstance(track_info, Exception):
+                        raise track_info
+                    queue_track = _add_song_to_queue(
+                        queue, spotify_track_id, track_info, fpjs_visitor_id)
+                    result['queue_song_id'] = str(queue_track.id)
+                elif operation.get('type') in ('upvote', 'unvote'):
+                    queue_song = _get_unqueued_song(operation.get('queue_song_id'))
+                    if str(queue_song.queue_id) != str(queue.id):
+                        raise RuntimeError('queue song not found')
+                    if operation['type'] == 'upvote':
+                        _upvote_song(queue_song, fpjs_visitor_id)
+                    else:
+                        _remove_song_upvote(queue_song, fpjs_visitor_id)
+                    result['queue_song_id'] = str(queue_song.id)
+                else:
+                    raise RuntimeError('invalid operation type')
+        except Exception as error:  # pylint: disable=broad-except
+            result['error_type'] = type(error).__name__
+            result['error_message'] = str(error)
+        results.append(result)
+
+    utils.bump_queue_version(queue)  # commit all successful operations at once
+    return {
+        'results': results,
+        'queue': utils.get_queue_with_tracks(queue, fpjs_visitor_id)}
 
 
 def end_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
@@ -193,15 +257,17 @@ def end_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
         raise RuntimeError('user is not starter of queue')
 
     queue.ended_on_utc = datetime.datetime.utcnow()
-    queue.save()
+    queue.save(commit=False)
+    utils.bump_queue_version(queue)
     return {}
 
 
-def pause_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
+def pause_queue(queue_id: str, fpjs_visitor_id: str, compact: bool = False) -> dict:
     """Pause a Mixify queue.
 
     :param queue_id: queue ID
     :param fpjs_visitor_id: FingerprintJS visitor ID
+    :param compact: return only the queue version and pause state, defaults to False
     :raises RuntimeError: if queue ID is invalid
     :return: paused queue object
     """
@@ -210,15 +276,20 @@ def pause_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
         raise RuntimeError('queue not found')
 
     queue.paused_on_utc = datetime.datetime.utcnow()
-    queue.save()
+    queue.save(commit=False)
+    utils.bump_queue_version(queue)
+
+    if compact:
+        return utils.get_queue_ack(queue)
     return utils.get_queue_with_tracks(queue, fpjs_visitor_id)
 
 
-def unpause_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
+def unpause_queue(queue_id: str, fpjs_visitor_id: str, compact: bool = False) -> dict:
     """Unpause a Mixify queue.
 
     :param queue_id: queue ID
     :param fpjs_visitor_id: FingerprintJS visitor ID
+    :param compact: return only the queue version and pause state, defaults to False
     :raises RuntimeError: if queue ID is invalid
     :return: unpaused queue object
     """
@@ -227,7 +298,11 @@ def unpause_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
         raise RuntimeError('queue not found')
 
     queue.paused_on_utc = None
-    queue.save()
+    queue.save(commit=False)
+    utils.bump_queue_version(queue)
+
+    if compact:
+        return utils.get_queue_ack(queue)
     return utils.get_queue_with_tracks(queue, fpjs_visitor_id)
 
 
@@ -237,7 +312,7 @@ def subscribe_to_queue(queue_id: str, spotify_access_token: str, fpjs_visitor_id
     :param queue_id: queue ID
     :param spotify_access_token: Spotify access token of subscriber
     :param fpjs_visitor_id: FingerprintJS visitor ID of subscriber
-    :return: queue object
+    :return: queue object without the host's access token and fingerprint
     """
     queue: models.Queues = models.Queues.query.filter_by(id=queue_id).first()
     if queue is None:
@@ -247,14 +322,15 @@ def subscribe_to_queue(queue_id: str, spotify_access_token: str, fpjs_visitor_id
     if existing_subscriber is not None:
         existing_subscriber.fpjs_visitor_id = fpjs_visitor_id
         existing_subscriber.save()
-        return queue.as_dict()
+        return utils.get_public_queue_info(queue)
 
     models.QueueSubscribers(
         queue_id=queue_id,
         spotify_access_token=spotify_access_token,
         fpjs_visitor_id=fpjs_visitor_id,
-        subscribed_on_utc=datetime.datetime.utcnow()).save()
-    return queue.as_dict()
+        subscribed_on_utc=datetime.datetime.utcnow()).save(commit=False)
+    utils.bump_queue_version(queue)
+    return utils.get_public_queue_info(queue)
 
 
 def unsubscribe_from_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
@@ -273,10 +349,57 @@ def unsubscribe_from_queue(queue_id: str, fpjs_visitor_id: str) -> dict:
     if subscriber is None:
         raise RuntimeError('subscriber not found')
 
-    subscriber.delete()
+    subscriber.delete(commit=False)
+    utils.bump_queue_version(queue)
     return utils.get_queue_with_tracks(queue, fpjs_visitor_id)
 
 
+def get_queue_stats(queue_id: str, fpjs_visitor_id: str) -> dict:
+    """Fetch activity stats for a Mixify queue and its host.
+
+    :param queue_id: queue ID
+    :param fpjs_visitor_id: FingerprintJS visitor ID
+    :raises RuntimeError: if queue ID is invalid or user is not starter of queue
+    :return: dict with queue stats, host stats and top contributors, ranked without their
+        FingerprintJS visitor IDs
+    """
+    queue: models.Queues = models.Queues.query.filter_by(id=queue_id).first()
+    if queue is None:
+        raise RuntimeError('queue not found')
+    if queue.started_by_fpjs_visitor_id != fpjs_visitor_id:
+        raise RuntimeError('user is not starter of queue')
+
+    queue_stats: models.QueueStats = models.QueueStats.query.filter_by(queue_id=queue.id).first()
+    host_stats: models.HostStats = models.HostStats.query.filter_by(
+        spotify_user_id=queue.spotify_user_id).first()
+    top_contributors: list[models.QueueContributorStats] = (
+        models.QueueContributorStats.query.filter_by(queue_id=queue.id).order_by(
+            models.QueueContributorStats.contributions.desc()).limit(TOP_CONTRIBUTORS).all())
+
+    host_stats_info = None
+    if host_stats is not None:
+        host_stats_info = host_stats.as_dict()
+        host_stats_info['revenue_usd'] = float(host_stats.revenue_usd)
+        host_stats_info['payout_usd'] = float(host_stats.revenue_usd) * (
+            config.BOOST_HOST_PAYOUT_PERCENT / 100)
+    queue_stats_info = None
+    if queue_stats is not None:
+        queue_stats_info = queue_stats.as_dict()
+        queue_stats_info['revenue_usd'] = float(queue_stats.revenue_usd)
+
+    return {
+        'queue': queue_stats_info,
+        'host': host_stats_info,
+        'top_contributors': [{
+            'rank': rank,
+            'is_host': contributor.fpjs_visitor_id == queue.started_by_fpjs_visitor_id,
+            'songs_added': contributor.songs_added,
+            'upvotes': contributor.upvotes,
+            'boosts': contributor.boosts,
+            'contributions': contributor.contributions}
+            for rank, contributor in enumerate(top_contributors, start=1)]}
+
+
 def create_boost_payment(queue_song_id: str, fpjs_visitor_id: str) -> dict:
     """Create the Stripe payment intent to boost a song in a Mixify queue.
 
@@ -294,22 +417,50 @@ def create_boost_payment(queue_song_id: str, fpjs_visitor_id: str) -> dict:
         raise RuntimeError('queue is paused')
     if queue_song.queue.ended_on_utc is not None:
         raise RuntimeError('queue is ended')
+    if queue_song.queue.suspended_on_utc is not None:
+        raise RuntimeError('queue is suspended')
+
+    # Reuse the visitor's pending payment intent for this song if one exists
+    current_utc = datetime.datetime.utcnow()
+    pending_payment_intents: list[models.BoostPaymentIntents] = (
+        models.BoostPaymentIntents.query.filter_by(
+            queue_song_id=queue_song.id, fpjs_visitor_id=fpjs_visitor_id,
+            used_on_utc=None, canceled_on_utc=None).all())
+    for payment_intent in pending_payment_intents:
+        if (payment_intent.expires_on_utc > current_utc
+                and float(payment_intent.cost_usd) == config.BOOST_COST_USD):
+            return {'stripe_client_secret': payment_intent.stripe_client_secret}
 
     # Create Stripe payment intent for the boost
     try:
-        stripe_client_secret = payments.create_boost_payment(
+        stripe_payment = payments.create_boost_payment(
             config.BOOST_COST_USD, queue_song_id, fpjs_visitor_id)
     except Exception as error:  # pylint: disable=broad-except
         raise RuntimeError(f'unable to create stripe payment: {str(error)}') from error
 
-    return {'stripe_client_secret': stripe_client_secret}
+    # Replace stale intents, which are canceled on Stripe by the queue manager
+    for payment_intent in pending_payment_intents:
+        payment_intent.canceled_on_utc = current_utc
+        payment_intent.save(commit=False)
+    models.BoostPaymentIntents(
+        queue_song_id=queue_song.id,
+        fpjs_visitor_id=fpjs_visitor_id,
+        stripe_payment_intent_id=stripe_payment['payment_intent_id'],
+        stripe_client_secret=stripe_payment['client_secret'],
+        cost_usd=config.BOOST_COST_USD,
+        created_on_utc=current_utc,
+        expires_on_utc=current_utc + datetime.timedelta(
+            minutes=config.BOOST_PAYMENT_INTENT_TTL_MINUTES)).save()
+
+    return {'stripe_client_secret': stripe_payment['client_secret']}
 
 
-def boost_song(queue_song_id: str, fpjs_visitor_id: str) -> dict:
+def boost_song(queue_song_id: str, fpjs_visitor_id: str, compact: bool = False) -> dict:
     """Immedately queue an unplayed song in a Mixify queue.
 
     :param queue_song_id: queue song ID
     :param fpjs_visitor_id: FingerprintJS visitor ID
+    :param compact: return only the boosted song and queue version, defaults to False
     :raises RuntimeError: if queue song ID is invalid or already queued on Spotify
     :return: updated queue with boosted song
     """
@@ -322,21 +473,141 @@ def boost_song(queue_song_id: str, fpjs_visitor_id: str) -> dict:
         raise RuntimeError('queue is paused')
     if queue_song.queue.ended_on_utc is not None:
         raise RuntimeError('queue is ended')
+    if queue_song.queue.suspended_on_utc is not None:
+        raise RuntimeError('queue is suspended')
+
+    # Stage the song for the host's Spotify queue, sent in the background
+    queue_song.added_to_spotify_queue_on_utc = datetime.datetime.utcnow()
+    queue_song.save(commit=False)
+    outbox.enqueue_queue_song(queue_song)
+    utils.close_boost_payment_intents(queue_song, boosted_by_fpjs_visitor_id=fpjs_visitor_id)
+
+    # Record new boost for host payout
+    models.QueueSongBoosts(
+        queue_id=queue_song.queue.id,
+        queue_song_id=queue_song.id,
+        boosted_by_fpjs_visitor_id=fpjs_visitor_id,
+        cost_usd=config.BOOST_COST_USD).save(commit=False)
+    utils.record_queue_activity(
+        queue_song.queue, fpjs_visitor_id, boosts=1, revenue_usd=config.BOOST_COST_USD)
+    utils.bump_queue_version(queue_song.queue)
+    outbox.drain_in_background()
+
+    if compact:
+        return utils.get_queue_song_ack(queue_song, fpjs_visitor_id)
+    return utils.get_queue_with_tracks(queue_song.queue, fpjs_visitor_id)
 
-    # Queue the song on the host's Spotify
-    try:
-        spotify.add_to_queue(queue_song.queue.spotify_access_token, queue_song.spotify_track_uri)
-    except Exception as error:  # pylint: disable=broad-except
-        raise RuntimeError(f'unable to queue song: {str(error)}') from error
-    else:
-        queue_song.added_to_spotify_queue_on_utc = datetime.datetime.utcnow()
-        queue_song.save()
-
-        # Record new boost for host payout
-        models.QueueSongBoosts(
-            queue_id=queue_song.queue.id,
-            queue_song_id=queue_song.id,
-            boosted_by_fpjs_visitor_id=fpjs_visitor_id,
-            cost_usd=config.BOOST_COST_USD).save()
 
-    return utils.get_queue_with_tracks(queue_song.queue, fpjs_visitor_id)
+def _get_open_queue(queue_id: str) -> models.Queues:
+    """Fetch a Mixify queue that songs can be added to.
+
+    :param queue_id: ID of Mixify queue
+    :raises RuntimeError: if queue ID is invalid, or queue has been ended or suspended
+    :return: queue object
+    """
+    queue: models.Queues = models.Queues.query.filter_by(id=queue_id).first()
+    if queue is None:
+        raise RuntimeError('queue not found')
+    if queue.ended_on_utc is not None:
+        raise RuntimeError('queue is ended')
+    if queue.suspended_on_utc is not None:
+        raise RuntimeError('queue is suspended')
+    return queue
+
+
+def _get_unqueued_song(queue_song_id: str) -> models.QueueSongs:
+    """Fetch a song in a Mixify queue that has not been queued on Spotify yet.
+
+    :param queue_song_id: queue song ID
+    :raises RuntimeError: if queue song ID is invalid or already queued on Spotify
+    :return: queue song object
+    """
+    queue_song: models.QueueSongs = models.QueueSongs.query.filter_by(id=queue_song_id).first()
+    if queue_song is None:
+        raise RuntimeError('queue song not found')
+    if queue_song.added_to_spotify_queue_on_utc is not None:
+        raise RuntimeError('song already queued on Spotify')
+    return queue_song
+
+
+def _fetch_track_info(queue: models.Queues, spotify_track_id: str) -> dict:
+    """Fetch a track from Spotify to add to a Mixify queue.
+
+    :param queue: Mixify queue object
+    :param spotify_track_id: Track ID of song on Spotify
+    :raises RuntimeError: if track ID is invalid
+    :return: dict with track info
+    """
+    track_info = spotify.get_track(queue.spotify_access_token, spotify_track_id)
+    if 'id' not in track_info or track_info['id'] is None:
+        raise RuntimeError('Spotify track not found')
+    return track_info
+
+
+def _add_song_to_queue(queue: models.Queues, spotify_track_id: str, track_info: dict,
+                       fpjs_visitor_id: str) -> models.QueueSongs:
+    """Add a song from Spotify to a Mixify queue without committing.
+
+    :param queue: Mixify queue object
+    :param spotify_track_id: Track ID of song on Spotify
+    :param track_info: dict with track info from Spotify
+    :param fpjs_visitor_id: FingerprintJS ID of user who added track
+    :raises RuntimeError: if song is already in the queue
+    :return: new queue song object
+    """
+    if models.QueueSongs.query.filter_by(
+            queue_id=queue.id, spotify_track_id=spotify_track_id,
+            added_to_spotify_queue_on_utc=None).first() is not None:
+        raise RuntimeError('song already in queue')
+
+    utils.save_known_track(track_info)
+    utils.record_queue_activity(queue, fpjs_visitor_id, songs_added=1)
+    return models.QueueSongs(
+        queue_id=queue.id,
+        name=track_info['name'],
+        artist=', '.join([artist['name'] for artist in track_info['artists']]),
+        album_cover_url=track_info['album']['images'][0]['url'],
+        duration_ms=track_info['duration_ms'],
+        spotify_track_id=spotify_track_id,
+        spotify_track_uri=track_info['uri'],
+        added_by_fpjs_visitor_id=fpjs_visitor_id,
+        added_on_utc=datetime.datetime.utcnow()).save(commit=False)
+
+
+def _upvote_song(queue_song: models.QueueSongs, fpjs_visitor_id: str) -> None:
+    """Upvote a song in a Mixify queue without committing.
+
+    :param queue_song: queue song object
+    :param fpjs_visitor_id: FingerprintJS visitor ID
+    """
+    current_utc = datetime.datetime.utcnow()
+    models.QueueSongUpvotes(
+        queue_song_id=queue_song.id,
+        upvoted_by_fpjs_visitor_id=fpjs_visitor_id,
+        upvoted_on_utc=current_utc).save(commit=False)
+    utils.record_queue_activity(queue_song.queue, fpjs_visitor_id, upvotes=1)
+
+    # Flag first like for queue ordering
+    if queue_song.first_liked_on_utc is None:
+        queue_song.first_liked_on_utc = current_utc
+        queue_song.save(commit=False)
+
+
+def _remove_song_upvote(queue_song: models.QueueSongs, fpjs_visitor_id: str) -> None:
+    """Remove an upvote on a song in a Mixify queue without committing.
+
+    :param queue_song: queue song object
+    :param fpjs_visitor_id: FingerprintJS visitor ID
+    :raises RuntimeError: if the visitor has not upvoted the song
+    """
+    queue_song_upvote: models.QueueSongUpvotes = models.QueueSongUpvotes.query.filter_by(
+        queue_song_id=queue_song.id, upvoted_by_fpjs_visitor_id=fpjs_visitor_id).first()
+    if queue_song_upvote is None:
+        raise RuntimeError('queue song upvote not found')
+    queue_song_upvote.delete(commit=False)
+    utils.record_queue_activity(queue_song.queue, fpjs_visitor_id, upvotes=-1)
+
+    # Remove first liked flag if song has no upvotes now
+    if models.QueueSongUpvotes.query.filter_by(queue_song_id=queue_song.id).first() is None:
+        queue_song.first_liked_on_utc = None
+        queue_song.save(commit=False)
@@ -0,0 +1,177 @@
+"""Spotify queue write outbox module.
+
+Songs are staged for Spotify queues in the same transaction as the Mixify queue change, then
+sent by background workers with retries, so slow or failed Spotify calls never block requests
+or drop writes.
+"""
+import concurrent.futures
+import datetime
+import threading
+import flask
+import config
+from api import spotify
+from api import utils
+from db import connection
+from db import models
+from db import transactions
+
+# One background drain thread per process. A drain requested while another is waiting to start
+# is dropped, since the waiting drain will pick up the new entries too
+_background_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='outbox-drain')
+_background_drains: list[concurrent.futures.Future] = []
+_background_drains_lock = threading.Lock()
+
+
+def enqueue_queue_song(queue_song: models.QueueSongs) -> None:
+    """Stage a queue song for the Spotify queues of the host and all subscribers.
+
+    Entries are saved without committing so they share the caller's transaction.
+
+    :param queue_song: queue song flagged as added to the Spotify queue
+    """
+    queue = queue_song.queue
+    current_utc = datetime.datetime.utcnow()
+    staged_on = queue_song.added_to_spotify_queue_on_utc or current_utc
+    targets: list[str | None] = [None]  # queue host
+    for subscriber in models.QueueSubscribers.query.filter_by(queue_id=queue.id).all():
+        if queue.spotify_access_token == subscriber.spotify_access_token:
+            continue  # subcriber is host, skip
+        targets.append(subscriber.id)
+
+    for subscriber_id in targets:
+        models.SpotifyOutbox(
+            queue_id=queue.id,
+            queue_song_id=queue_song.id,
+            subscriber_id=subscriber_id,
+            spotify_track_id=queue_song.spotify_track_id,
+            spotify_track_uri=queue_song.spotify_track_uri,
+            idempotency_key=f'{queue_song.id}:{subscriber_id or "host"}:{staged_on.isoformat()}',
+            created_on_utc=current_utc,
+            next_attempt_on_utc=current_utc).save(commit=False)
+
+
+def drain(limit: int | None = None) -> int:
+    """Send pending outbox entries to Spotify.
+
+    Each entry is claimed in its own transaction by pushing back its next attempt time, so
+    concurrent workers skip it and a crashed worker's entry is retried after the backoff.
+
+    :param limit: max entries to process, defaults to SPOTIFY_OUTBOX_DRAIN_LIMIT
+    :return: number of entries sent
+    """
+    sent_count = 0
+    for _ in range(limit or config.SPOTIFY_OUTBOX_DRAIN_LIMIT):
+        current_utc = datetime.datetime.utcnow()
+        entry: models.SpotifyOutbox = models.SpotifyOutbox.query.filter(
+            models.SpotifyOutbox.sent_on_utc.is_(None),
+            models.SpotifyOutbox.failed_on_utc.is_(None),
+            models.SpotifyOutbox.next_attempt_on_utc <= current_utc).order_by(
+                models.SpotifyOutbox.created_on_utc).with_for_update(skip_locked=True).first()
+        if entry is None:
+            break
+
+        # Claim entry, doubling as the retry schedule if this attempt fails
+        entry.attempt_count += 1
+        entry.next_attempt_on_utc = current_utc + datetime.timedelta(
+            seconds=config.SPOTIFY_OUTBOX_RETRY_SECONDS * (2 ** (entry.attempt_count - 1)))
+        entry.save()
+
+        _send(entry)
+        entry.save()
+        if entry.sent_on_utc is not None:
+            sent_count += 1
+    return sent_count
+
+
+def drain_in_background() -> None:
+    """Drain the outbox in the background so the current request can return immediately."""
+    app = flask.current_app._get_current_object()  # pylint: disable=protected-access
+
+    def _drain_with_app_context():
+        with app.app_context():
+            drain()
+
+    with _background_drains_lock:
+        _background_drains[:] = [
+            drain_future for drain_future in _background_drains if not drain_future.done()]
+        if any(not drain_future.running() for drain_future in _background_drains):
+            return  # a drain is already waiting to start
+        _background_drains.append(_background_executor.submit(_drain_with_app_context))
+
+
+def wait_for_background_drains(timeout_seconds: float) -> None:
+    """Wait for background drains to finish, e.g. before a server worker exits.
+
+    Entries left unsent are picked up by the next drain in any process.
+
+    :param timeout_seconds: max seconds to wait for all drains
+    """
+    with _background_drains_lock:
+        drain_futures = list(_background_drains)
+    concurrent.futures.wait(drain_futures, timeout_seconds)
+
+
+def prune() -> int:
+    """Delete outbox entries sent or failed more than SPOTIFY_OUTBOX_RETENTION_HOURS ago.
+
+    :return: number of entries deleted
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=config.SPOTIFY_OUTBOX_RETENTION_HOURS)
+    deleted_count = models.SpotifyOutbox.query.filter(
+        connection.SQL.or_(
+            models.SpotifyOutbox.sent_on_utc < cutoff,
+            models.SpotifyOutbox.failed_on_utc < cutoff)).delete(synchronize_session=False)
+    transactions.update_properties()
+    return deleted_count
+
+
+def _send(entry: models.SpotifyOutbox) -> None:
+    """Add an outbox entry's track to its target Spotify queue, recording the outcome.
+
+    :param entry: claimed outbox entry
+    """
+    current_utc = datetime.datetime.utcnow()
+    queue = entry.queue
+    access_token = queue.spotify_access_token
+    if entry.subscriber_id is None:
+        if not utils.spotify_calls_allowed(queue):
+            entry.attempt_count -= 1  # host token unusable, wait without spending an attempt
+            return
+    else:
+        subscriber: models.QueueSubscribers = models.QueueSubscribers.query.filter_by(
+            id=entry.subscriber_id).first()
+        if subscriber is None:
+            entry.last_error = 'subscriber not found'
+            entry.failed_on_utc = current_utc
+            return
+        access_token = subscriber.spotify_access_token
+
+    try:
+        # A previous attempt may have reached Spotify before its worker recorded the outcome,
+        # if the track now appears in the Spotify queue more often than before that attempt
+        track_count = spotify.get_playback_info(access_token)['queue'].count(
+            entry.spotify_track_id)
+        if (entry.spotify_queue_track_count is not None
+                and track_count > entry.spotify_queue_track_count):
+            entry.sent_on_utc = current_utc
+            return
+        entry.spotify_queue_track_count = track_count
+        entry.save()  # record before sending, so a crash mid-send leaves the marker
+        spotify.add_to_queue(access_token, entry.spotify_track_uri)
+    except Exception as error:  # pylint: disable=broad-except
+        entry.last_error = str(error)
+        if entry.subscriber_id is None and isinstance(error, spotify.AccessTokenError):
+            utils.record_spotify_token_failure(queue, commit=False)
+        if entry.attempt_count >= config.SPOTIFY_OUTBOX_MAX_ATTEMPTS:
+            entry.failed_on_utc = current_utc
+
+            # Return song to the Mixify queue so the manager can pick it again, ahead of all
+            # unboosted songs if it was boosted
+            if entry.subscriber_id is None:
+                entry.queue_song.added_to_spotify_queue_on_utc = None
+                entry.queue_song.save(commit=False)
+                utils.bump_queue_version(queue, commit=False)
+    else:
+        entry.sent_on_utc = current_utc
@@ -5,13 +5,13 @@ import stripe
 stripe.api_key = config.STRIPE_SECRET_KEY
 
 
-def create_boost_payment(cost_usd: float, queue_song_id: str, fpjs_visitor_id: str) -> str:
+def create_boost_payment(cost_usd: float, queue_song_id: str, fpjs_visitor_id: str) -> dict:
     """Create a Stripe payment intent for Mixify boost.
 
     :param cost_usd: payment amount in USD
     :param queue_song_id: ID of song being boosted
     :param fpjs_visitor_id: FingerprintJS visitor ID
-    :return: intent client secret
+    :return: dict with intent ID and client secret
     """
     intent = stripe.PaymentIntent.create(
         amount=int(cost_usd * 100),
@@ -23,4 +23,20 @@ def create_boost_payment(cost_usd: float, queue_song_id: str, fpjs_visitor_id: s
             'queue_song_id': queue_song_id,
             'fpjs_visitor_id': fpjs_visitor_id
         })
-    return intent.client_secret
+    return {
+        'payment_intent_id': intent.id,
+        'client_secret': intent.client_secret}
+
+
+def cancel_boost_payment(payment_intent_id: str) -> bool:
+    """Cancel a Stripe payment intent for Mixify boost, unless its payment is processing.
+
+    :param payment_intent_id: ID of payment intent
+    :return: False if the payment is processing and cancellation should be retried later
+    """
+    intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+    if intent.status == 'processing':
+        return False
+    if intent.status not in ('succeeded', 'canceled'):
+        stripe.PaymentIntent.cancel(payment_intent_id)
+    return True
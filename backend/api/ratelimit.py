@@ -0,0 +1,134 @@
+"""Spotify API rate limit governor module.
+
+All app processes draw from a single token bucket stored in the database, so the Mixify app ID
+stays under Spotify's rate limit no matter how many workers are serving requests. Background
+calls (e.g. the queue manager) leave a reserve of tokens for interactive guest requests.
+"""
+import contextlib
+import contextvars
+import datetime
+import time
+import typing
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+import config
+from db import connection
+from db import models
+
+BUCKET_ID = 'spotify'
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar(
+    'spotify_priority', default=PRIORITY_INTERACTIVE)
+
+
+@contextlib.contextmanager
+def background_priority() -> typing.Iterator[None]:
+    """Run the enclosed Spotify calls at background priority."""
+    token = _priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def acquire() -> None:
+    """Wait for permission to make a single Spotify API request.
+
+    :raises RuntimeError: if permission is not granted within the max wait
+    """
+    reserve = 0.0
+    if _priority.get() == PRIORITY_BACKGROUND:
+        reserve = config.SPOTIFY_RATE_LIMIT_BURST * (
+            config.SPOTIFY_RATE_LIMIT_BACKGROUND_RESERVE_PERCENT / 100)
+    deadline = time.monotonic() + config.SPOTIFY_RATE_LIMIT_MAX_WAIT_SECONDS
+    while True:
+        wait_seconds = _take_token(reserve)
+        if wait_seconds <= 0:
+            return
+        if time.monotonic() + wait_seconds > deadline:
+            raise RuntimeError('Spotify rate limit exceeded')
+        time.sleep(wait_seconds)
+
+
+def record_retry_after(retry_after_seconds: float) -> None:
+    """Block all Spotify API requests after Spotify responds with 429 Too Many Requests.
+
+    :param retry_after_seconds: value of the Retry-After response header
+    """
+    current_utc = datetime.datetime.utcnow()
+    blocked_until = current_utc + datetime.timedelta(seconds=retry_after_seconds)
+    table = models.SpotifyRateLimits.__table__
+    with connection.SQL.engine.begin() as conn:
+        _create_bucket(conn, current_utc)
+        # Skipped if already blocked for longer
+        conn.execute(table.update().where(
+            table.c.id == BUCKET_ID,
+            sqlalchemy.or_(table.c.blocked_until_utc.is_(None),
+                           table.c.blocked_until_utc < blocked_until)).values(
+            tokens=0.0, refilled_on_utc=current_utc, blocked_until_utc=blocked_until))
+
+
+def _take_token(reserve: float) -> float:
+    """Take a token from the shared bucket if enough are available.
+
+    The refill and take happen in a single conditional UPDATE, so the bucket row is only locked
+    for the duration of that statement rather than across several round trips.
+
+    :param reserve: tokens that must remain in the bucket after taking one
+    :return: seconds to wait before trying again, or 0 if a token was taken
+    """
+    table = models.SpotifyRateLimits.__table__
+    while True:
+        current_utc = datetime.datetime.utcnow()
+
+        # Tokens in the bucket after refilling for time elapsed since last refill
+        elapsed_seconds = sqlalchemy.func.greatest(0.0, sqlalchemy.extract(
+            'epoch',
+            sqlalchemy.literal(current_utc, sqlalchemy.DateTime) - table.c.refilled_on_utc))
+        tokens = sqlalchemy.func.least(
+            config.SPOTIFY_RATE_LIMIT_BURST,
+            table.c.tokens + elapsed_seconds * config.SPOTIFY_RATE_LIMIT_PER_SECOND)
+
+        with connection.SQL.engine.begin() as conn:
+            taken = conn.execute(table.update().where(
+                table.c.id == BUCKET_ID,
+                sqlalchemy.or_(table.c.blocked_until_utc.is_(None),
+                               table.c.blocked_until_utc <= current_utc),
+                tokens >= 1 + reserve).values(
+                tokens=tokens - 1,
+                refilled_on_utc=sqlalchemy.func.greatest(table.c.refilled_on_utc, current_utc),
+            ).returning(table.c.id)).first()
+        if taken is not None:
+            return 0.0
+
+        # No token taken, estimate the wait from the current bucket without locking it
+        with connection.SQL.engine.begin() as conn:
+            if _create_bucket(conn, current_utc):
+                continue  # take from the new full bucket
+            bucket = conn.execute(
+                sqlalchemy.select(table).where(table.c.id == BUCKET_ID)).first()
+        if bucket.blocked_until_utc is not None and bucket.blocked_until_utc > current_utc:
+            return (bucket.blocked_until_utc - current_utc).total_seconds()
+        elapsed = max(0.0, (current_utc - bucket.refilled_on_utc).total_seconds())
+        available = min(config.SPOTIFY_RATE_LIMIT_BURST,
+                        bucket.tokens + elapsed * config.SPOTIFY_RATE_LIMIT_PER_SECOND)
+        if available < 1 + reserve:
+            return (1 + reserve - available) / config.SPOTIFY_RATE_LIMIT_PER_SECOND
+        # Bucket was changed by another request since the update, try again
+
+
+def _create_bucket(conn: sqlalchemy.engine.Connection, current_utc: datetime.datetime) -> bool:
+    """Create the shared bucket row, full, if it does not exist yet.
+
+    :param conn: database connection with an open transaction
+    :param current_utc: current UTC time
+    :return: True if the bucket was created
+    """
+    table = models.SpotifyRateLimits.__table__
+    created = conn.execute(postgresql.insert(table).values(
+        id=BUCKET_ID,
+        tokens=config.SPOTIFY_RATE_LIMIT_BURST,
+        refilled_on_utc=current_utc).on_conflict_do_nothing().returning(table.c.id)).first()
+    return created is not None
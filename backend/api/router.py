@@ -1,9 +1,13 @@
 """Mixify API router module."""
 import sys
+import time
 import typing
 import flask
+import config
+from api import capture
 from api.controllers import queue_controller
 from api.controllers import manager_controller
+from db import querybudget
 
 
 def route(app: flask.Flask):
@@ -22,26 +26,34 @@ def route(app: flask.Flask):
         defaults={'endpoint_func': queue_controller.end_queue})(_exec_request)
     app.route(
         '/v1/queue/pause/<queue_id>/<fpjs_visitor_id>', methods=['GET'],
-        defaults={'endpoint_func': queue_controller.pause_queue})(_exec_request)
+        defaults={'endpoint_func': queue_controller.pause_queue})(_exec_mutation_request)
     app.route(
         '/v1/queue/unpause/<queue_id>/<fpjs_visitor_id>', methods=['GET'],
-        defaults={'endpoint_func': queue_controller.unpause_queue})(_exec_request)
+        defaults={'endpoint_func': queue_controller.unpause_queue})(_exec_mutation_request)
+
+    app.route(
+        '/v1/queue/stats/<queue_id>/<fpjs_visitor_id>', methods=['GET'],
+        defaults={'endpoint_func': queue_controller.get_queue_stats})(_exec_request)
 
     # Voting
     app.route(
         '/v1/queue/upvote/<queue_song_id>/<fpjs_visitor_id>', methods=['GET'],
-        defaults={'endpoint_func': queue_controller.upvote_song})(_exec_request)
+        defaults={'endpoint_func': queue_controller.upvote_song})(_exec_mutation_request)
     app.route(
         '/v1/queue/upvote/remove/<queue_song_id>/<fpjs_visitor_id>', methods=['GET'],
-        defaults={'endpoint_func': queue_controller.remove_song_upvote})(_exec_request)
+        defaults={'endpoint_func': queue_controller.remove_song_upvote})(_exec_mutation_request)
+
+    app.route(
+        '/v1/queue/batch/<queue_id>/<fpjs_visitor_id>', methods=['POST'],
+        defaults={'endpoint_func': queue_controller.apply_batch})(_exec_batch_request)
 
     # Searching
     app.route(
         '/v1/search/<queue_id>/<search_query>', methods=['GET'],
-        defaults={'endpoint_func': queue_controller.search_tracks})(_exec_request)
+        defaults={'endpoint_func': queue_controller.search_tracks})(_exec_search_request)
     app.route(
         '/v1/queue/add/<queue_id>/<spotify_track_id>/<fpjs_visitor_id>', methods=['GET'],
-        defaults={'endpoint_func': queue_controller.add_song_to_queue})(_exec_request)
+        defaults={'endpoint_func': queue_controller.add_song_to_queue})(_exec_mutation_request)
 
     # Subscribing
     app.route(
@@ -57,12 +69,54 @@ def route(app: flask.Flask):
         defaults={'endpoint_func': queue_controller.create_boost_payment})(_exec_request)
     app.route(
         '/v1/queue/boost/<queue_song_id>/<fpjs_visitor_id>', methods=['GET'],
-        defaults={'endpoint_func': queue_controller.boost_song})(_exec_request)
+        defaults={'endpoint_func': queue_controller.boost_song})(_exec_mutation_request)
 
     # Managing
     app.route(
         '/v1/manager/<token>', methods=['GET'],
         defaults={'endpoint_func': manager_controller.manage_active_queues})(_exec_request)
+    app.route(
+        '/v1/manager/outbox/<token>', methods=['GET'],
+        defaults={'endpoint_func': manager_controller.drain_spotify_outbox})(_exec_request)
+
+
+def _exec_mutation_request(endpoint_func: typing.Callable,
+                           *args, **kwargs) -> tuple[dict[str, typing.Any], int]:
+    """Safely execute a mutation API request.
+
+    Passing `?compact=true` opts in to a lightweight acknowledgement response.
+
+    :param endpoint_func: function to call for the request
+    :return: request response
+    """
+    kwargs['compact'] = flask.request.args.get('compact', '').lower() in ('1', 'true')
+    return _exec_request(endpoint_func, *args, **kwargs)
+
+
+def _exec_search_request(endpoint_func: typing.Callable,
+                         *args, **kwargs) -> tuple[dict[str, typing.Any], int]:
+    """Safely execute a search API request.
+
+    Passing `?local=true` skips Spotify and searches previously queued tracks only.
+
+    :param endpoint_func: function to call for the request
+    :return: request response
+    """
+    kwargs['local_only'] = flask.request.args.get('local', '').lower() in ('1', 'true')
+    return _exec_request(endpoint_func, *args, **kwargs)
+
+
+def _exec_batch_request(endpoint_func: typing.Callable,
+                        *args, **kwargs) -> tuple[dict[str, typing.Any], int]:
+    """Safely execute a batch API request with operations from the JSON body.
+
+    :param endpoint_func: function to call for the request
+    :return: request response
+    """
+    request_body = flask.request.get_json(silent=True)
+    operations = request_body.get('operations') if isinstance(request_body, dict) else None
+    kwargs['operations'] = operations if isinstance(operations, list) else []
+    return _exec_request(endpoint_func, *args, **kwargs)
 
 
 def _exec_request(endpoint_func: typing.Callable,
@@ -72,14 +126,24 @@ def _exec_request(endpoint_func: typing.Callable,
     :param endpoint_func: function to call for the request
     :return: request response
     """
+    started = time.monotonic()
     try:
-        # Status 200 OK
-        return endpoint_func(*args, **kwargs), 200
+        with querybudget.track(
+                endpoint_func.__name__,
+                getattr(endpoint_func, 'query_budget', config.SQL_QUERY_BUDGET),
+                getattr(endpoint_func, 'duplicate_query_threshold',
+                        config.SQL_DUPLICATE_QUERY_THRESHOLD)):
+            # Status 200 OK
+            response, status_code = endpoint_func(*args, **kwargs), 200
     except Exception as error:  # pylint: disable=broad-except
-        response: dict[str, str] = {}
+        response = {}
         response['error_type'] = type(error).__name__
         response['error_message'] = str(error)
 
         status_code = 500  # default Internal Server Error
         sys.stderr.write(f'{str(response)}\n')
-        return response, status_code
+
+    if capture.enabled():
+        capture.record_request(
+            endpoint_func.__name__, response, status_code, time.monotonic() - started)
+    return response, status_code
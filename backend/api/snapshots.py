@@ -0,0 +1,97 @@
+"""Per-process queue snapshot cache module.
+
+Many guests poll the same queue at once. The first request to miss the cache builds the queue
+snapshot while concurrent requests for that queue wait and share the result (single-flight).
+Snapshots are keyed by queue version, so a mutation in any process invalidates them.
+"""
+import threading
+import time
+import typing
+import config
+
+# Max seconds a request waits for another request to build a snapshot
+BUILD_WAIT_SECONDS = 30
+
+
+class _SnapshotEntry:
+    """Cached snapshot of a single queue, or one being built."""
+
+    def __init__(self, building_version: int):
+        self.built = threading.Event()
+        self.building_version = building_version  # queue version the build was started for
+        self.snapshot: dict | None = None
+        self.version: int | None = None
+        self.expires_at = 0.0
+        self.error: Exception | None = None
+
+
+_lock = threading.Lock()
+_entries: dict[str, _SnapshotEntry] = {}
+
+
+def get_or_build(queue_id: typing.Any, version: int,
+                 build_func: typing.Callable[[], tuple[dict, int]]) -> dict:
+    """Fetch the cached snapshot of a queue, building it once if missing or stale.
+
+    :param queue_id: ID of queue
+    :param version: current version of queue
+    :param build_func: function returning the snapshot and the queue version it reflects
+    :raises RuntimeError: if building the snapshot failed in another request
+    :return: shared snapshot, which must not be modified
+    """
+    key = str(queue_id)
+    with _lock:
+        entry = _entries.get(key)
+        if (entry is not None and not entry.built.is_set()
+                and entry.building_version >= version):
+            is_builder = False  # another request is building this version, wait for it
+        elif (entry is not None and entry.snapshot is not None and entry.version >= version
+              and entry.expires_at > time.monotonic()):
+            return entry.snapshot
+        else:
+            # Start a new build, replacing any older build in progress, which still finishes
+            # for the requests already waiting on it
+            _prune_expired()
+            entry = _SnapshotEntry(version)
+            _entries[key] = entry
+            is_builder = True
+
+    if not is_builder:
+        if not entry.built.wait(BUILD_WAIT_SECONDS):
+            raise RuntimeError('timed out waiting for queue snapshot')
+        if entry.error is not None:
+            raise RuntimeError(str(entry.error)) from entry.error
+        return entry.snapshot
+
+    try:
+        entry.snapshot, entry.version = build_func()
+        entry.expires_at = time.monotonic() + config.QUEUE_SNAPSHOT_TTL_SECONDS
+    except Exception as error:
+        entry.error = error
+        with _lock:
+            if _entries.get(key) is entry:
+                del _entries[key]
+        raise
+    finally:
+        entry.built.set()
+    return entry.snapshot
+
+
+def invalidate(queue_id: typing.Any) -> None:
+    """Drop the cached snapshot of a queue after a mutation in this process.
+
+    A build in progress is dropped too, so later requests never join a build that may have
+    started before the mutation.
+
+    :param queue_id: ID of queue
+    """
+    with _lock:
+        _entries.pop(str(queue_id), None)
+
+
+def _prune_expired() -> None:
+    """Drop expired snapshots of queues no longer being polled. Caller must hold the lock."""
+    now = time.monotonic()
+    for key in [key for key, entry in _entries.items()
+                if entry.built.is_set() and entry.expires_at <= now]:
+        del _entries[key]
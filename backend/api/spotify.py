@@ -1,6 +1,17 @@
 """Spotify API wrapper module."""
+import time
 import urllib.parse
 import requests
+import config
+from api import capture
+from api import ratelimit
+
+# Attempts per request when Spotify responds with 429 Too Many Requests
+MAX_RATE_LIMITED_ATTEMPTS = 2
+
+
+class AccessTokenError(RuntimeError):
+    """Raised when Spotify rejects an access token as expired or revoked."""
 
 
 def add_to_queue(access_token: str, track_uri) -> None:
@@ -10,7 +21,7 @@ def add_to_queue(access_token: str, track_uri) -> None:
     :param track_uri: URI of track
     """
     _exec_request(
-        f'https://api.spotify.com/v1/me/player/queue?uri={track_uri}',
+        f'{config.SPOTIFY_API_URL}/v1/me/player/queue?uri={track_uri}',
         requests.post,
         access_token)
 
@@ -23,7 +34,7 @@ def search(access_token: str, search_query: str) -> list[dict]:
     :return: list of tracks (search results)
     """
     resp = _exec_request(
-        f'https://api.spotify.com/v1/search?q={urllib.parse.quote(search_query)}&type=track',
+        f'{config.SPOTIFY_API_URL}/v1/search?q={urllib.parse.quote(search_query)}&type=track',
         requests.get,
         access_token)
     return resp.json()['tracks']['items']
@@ -35,7 +46,7 @@ def get_playback_info(access_token: str) -> dict:
     :param access_token: Spotify API access token
     :return: dict with playback info
     """
-    resp = _exec_request('https://api.spotify.com/v1/me/player/queue', requests.get, access_token)
+    resp = _exec_request(f'{config.SPOTIFY_API_URL}/v1/me/player/queue', requests.get, access_token)
     current_playback = resp.json()
     current_track_id = (None if current_playback['currently_playing'] is None
                         else current_playback['currently_playing']['id'])
@@ -53,7 +64,7 @@ def get_track(access_token: str, track_id: str) -> dict:
     :return: dict with track info
     """
     resp = _exec_request(
-        f'https://api.spotify.com/v1/tracks/{track_id}', requests.get, access_token)
+        f'{config.SPOTIFY_API_URL}/v1/tracks/{track_id}', requests.get, access_token)
     return resp.json()
 
 
@@ -64,7 +75,7 @@ def get_user(access_token: str) -> dict:
     :return: dict with user info
     """
     resp = _exec_request(
-        'https://api.spotify.com/v1/me', requests.get, access_token)
+        f'{config.SPOTIFY_API_URL}/v1/me', requests.get, access_token)
     return resp.json()
 
 
@@ -77,17 +88,33 @@ def _exec_request(
     :param access_token: Spotify API access token
     :param body: request body, defaults to None
     :param headers: request headers, defaults to None
-    :raises RuntimeError: _description_
-    :return: _description_
+    :raises AccessTokenError: if the access token is expired or revoked
+    :raises RuntimeError: if the request is unsuccessful
+    :return: request response
     """
     headers = headers if headers else {}
     headers['Authorization'] = 'Bearer ' + access_token  # append Spotify access token to headers
-    resp = method(url, headers=headers, data=(body if body else {}), timeout=30)  # execute request
+    for _ in range(MAX_RATE_LIMITED_ATTEMPTS):
+        ratelimit.acquire()  # wait for shared rate limit governor
+        started = time.monotonic()
+        resp = method(url, headers=headers, data=(body if body else {}), timeout=30)
+        if capture.enabled():
+            capture.record_spotify_call(
+                method.__name__.upper(), url, access_token, resp, time.monotonic() - started)
+        if resp.status_code != 429:
+            break
+        try:
+            retry_after_seconds = float(resp.headers.get('Retry-After', 1))
+        except ValueError:
+            retry_after_seconds = 1.0
+        ratelimit.record_retry_after(retry_after_seconds)  # back off globally
     if str(resp.status_code)[0] != '2':
         resp_error = None
         try:
             resp_error = resp.json()
         except Exception:  # pylint: disable=broad-except
             resp_error = resp.text
+        if resp.status_code == 401:
+            raise AccessTokenError(resp_error)
         raise RuntimeError(resp_error)
     return resp
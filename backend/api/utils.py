@@ -2,9 +2,16 @@
 import datetime
 import config
 import random
+from sqlalchemy.dialects import postgresql
+from db import connection
 from db import models
+from api import snapshots
 from api import spotify
 
+# Fields identifying a queue's host or a song's adder, never sent to other visitors
+PRIVATE_QUEUE_FIELDS = ('spotify_access_token', 'started_by_fpjs_visitor_id')
+PRIVATE_QUEUE_SONG_FIELDS = ('added_by_fpjs_visitor_id',)
+
 QUEUE_NAME_CHAR_OPTIONS = 'abcdefghjklmnopqrstuvwxyz123456789'
 QUEUE_NAME_LENGTH = 6
 
@@ -20,22 +27,308 @@ def generate_random_queue_name():
     return queue_name
 
 
+def spotify_calls_allowed(queue: models.Queues) -> bool:
+    """Check whether the host's Spotify access token should be used for a queue.
+
+    :param queue: Mixify queue object
+    :return: False if the queue is suspended or backing off after token failures
+    """
+    if queue.suspended_on_utc is not None:
+        return False
+    return (queue.spotify_token_retry_on_utc is None
+            or queue.spotify_token_retry_on_utc <= datetime.datetime.utcnow())
+
+
+def record_spotify_token_failure(queue: models.Queues, commit: bool = True) -> None:
+    """Record a rejected host access token, backing off exponentially until suspension.
+
+    :param queue: Mixify queue object
+    :param commit: immediately commit operation to DB, defaults to True
+    """
+    current_utc = datetime.datetime.utcnow()
+    queue.spotify_token_failure_count = (queue.spotify_token_failure_count or 0) + 1
+    backoff_minutes = config.SPOTIFY_TOKEN_BACKOFF_MINUTES * (
+        2 ** (queue.spotify_token_failure_count - 1))
+    queue.spotify_token_retry_on_utc = current_utc + datetime.timedelta(minutes=backoff_minutes)
+    if queue.spotify_token_failure_count >= config.SPOTIFY_TOKEN_MAX_FAILURES:
+        queue.suspended_on_utc = current_utc  # wait for host to refresh token
+    queue.save(commit)
+
+
+def reset_spotify_token_failures(queue: models.Queues, commit: bool = True) -> None:
+    """Clear token failure tracking and suspension for a queue.
+
+    :param queue: Mixify queue object
+    :param commit: immediately commit operation to DB, defaults to True
+    """
+    if (queue.spotify_token_failure_count or queue.spotify_token_retry_on_utc is not None
+            or queue.suspended_on_utc is not None):
+        queue.spotify_token_failure_count = 0
+        queue.spotify_token_retry_on_utc = None
+        queue.suspended_on_utc = None
+        queue.save(commit)
+
+
+def close_boost_payment_intents(queue_song: models.QueueSongs,
+                                boosted_by_fpjs_visitor_id: str | None = None) -> None:
+    """Stop reusing pending boost payment intents once a song is queued on Spotify.
+
+    Closed intents are canceled on Stripe by the queue manager. Saved without committing.
+
+    :param queue_song: queue song that is no longer boostable
+    :param boosted_by_fpjs_visitor_id: visitor whose intent paid for the boost, if any
+    """
+    current_utc = datetime.datetime.utcnow()
+    for payment_intent in models.BoostPaymentIntents.query.filter_by(
+            queue_song_id=queue_song.id, used_on_utc=None, canceled_on_utc=None).all():
+        if payment_intent.fpjs_visitor_id == boosted_by_fpjs_visitor_id:
+            payment_intent.used_on_utc = current_utc
+        else:
+            payment_intent.canceled_on_utc = current_utc
+        payment_intent.save(commit=False)
+
+
+def save_known_track(track_info: dict) -> None:
+    """Record a Spotify track added to a Mixify queue for local search. Saved without committing.
+
+    :param track_info: Spotify track object
+    """
+    name = track_info['name']
+    artist = ', '.join([artist['name'] for artist in track_info['artists']])
+    known_track = {
+        'spotify_track_id': track_info['id'],
+        'name': name,
+        'artist': artist,
+        'album_cover_url': track_info['album']['images'][0]['url'],
+        'duration_ms': track_info['duration_ms'],
+        'explicit': track_info.get('explicit'),
+        'search_text': f'{name} {artist}'.lower(),
+        'queued_count': 1,
+        'last_queued_on_utc': datetime.datetime.utcnow()}
+    table = models.KnownTracks.__table__
+    insert = postgresql.insert(table).values(**known_track)
+    connection.SQL.session.execute(insert.on_conflict_do_update(  # pylint: disable=no-member
+        index_elements=[table.c.spotify_track_id],
+        set_={
+            **{key: insert.excluded[key] for key in known_track if key != 'queued_count'},
+            'queued_count': table.c.queued_count + 1}))
+
+
+def search_known_tracks(search_query: str, limit: int) -> list[dict]:
+    """Search tracks previously added to any Mixify queue by name and artist.
+
+    Matches substrings and, through the trigram index, misspellings. Prefix matches rank first,
+    then closer and more frequently queued tracks.
+
+    :param search_query: query to use for search
+    :param limit: max number of results
+    :return: list of tracks in search result format
+    """
+    search_text = search_query.strip().lower()
+    if not search_text:
+        return []
+    similarity = connection.SQL.func.similarity(models.KnownTracks.search_text, search_text)
+    known_tracks: list[models.KnownTracks] = models.KnownTracks.query.filter(connection.SQL.or_(
+        models.KnownTracks.search_text.contains(search_text, autoescape=True),
+        models.KnownTracks.search_text.op('%')(search_text))).order_by(
+            models.KnownTracks.search_text.startswith(search_text, autoescape=True).desc(),
+            similarity.desc(),
+            models.KnownTracks.queued_count.desc()).limit(limit).all()
+    return [{
+        'track_id': known_track.spotify_track_id,
+        'track_name': known_track.name,
+        'track_artist': known_track.artist,
+        'track_album_cover_url': known_track.album_cover_url,
+        'track_length': known_track.duration_ms,
+        'track_explicit': bool(known_track.explicit)} for known_track in known_tracks]
+
+
+def record_queue_started(queue: models.Queues) -> None:
+    """Count a new queue in its host's stats rollup. Saved without committing.
+
+    :param queue: new Mixify queue object
+    """
+    _increment_rollup(
+        models.HostStats, {'spotify_user_id': queue.spotify_user_id}, {'queues_started': 1})
+
+
+def record_queue_activity(queue: models.Queues, fpjs_visitor_id: str | None = None,
+                          **increments: float) -> None:
+    """Add activity to the queue, host and contributor stats rollups. Saved without committing.
+
+    :param queue: Mixify queue object
+    :param fpjs_visitor_id: FingerprintJS visitor ID of contributor, if any
+    :param increments: amounts to add to `songs_added`, `songs_played`, `upvotes`, `boosts`
+        and `revenue_usd`
+    """
+    _increment_rollup(models.QueueStats, {'queue_id': queue.id}, increments)
+    _increment_rollup(models.HostStats, {'spotify_user_id': queue.spotify_user_id}, increments)
+
+    contributor_increments = {
+        key: value for key, value in increments.items()
+        if key in ('songs_added', 'upvotes', 'boosts')}
+    if fpjs_visitor_id is not None and contributor_increments:
+        contributor_increments['contributions'] = sum(contributor_increments.values())
+        _increment_rollup(
+            models.QueueContributorStats,
+            {'queue_id': queue.id, 'fpjs_visitor_id': fpjs_visitor_id},
+            contributor_increments)
+
+
+def mark_queue_song_played(queue: models.Queues, queue_song: models.QueueSongs,
+                           played_on_utc: datetime.datetime) -> None:
+    """Flag a queue song as played and count the play, once. Saved without committing.
+
+    Pollers and the queue manager may detect the same play concurrently, so the song is only
+    flagged if still unplayed in the database, and only the request that flags it counts the play.
+
+    :param queue: Mixify queue object
+    :param queue_song: queue song object
+    :param played_on_utc: time the song was found playing
+    """
+    flagged_count = models.QueueSongs.query.filter(
+        models.QueueSongs.id == queue_song.id,
+        models.QueueSongs.played_on_utc.is_(None)).update(
+            {'played_on_utc': played_on_utc}, synchronize_session=False)
+    # Reload the flag, which this or a concurrent request has set by now
+    connection.SQL.session.refresh(queue_song, ['played_on_utc'])  # pylint: disable=no-member
+    if flagged_count == 1:
+        record_queue_activity(queue, songs_played=1)
+        bump_queue_version(queue)
+
+
+def _increment_rollup(model: type, keys: dict, increments: dict) -> None:
+    """Atomically add to the counters of a rollup row, creating it if necessary.
+
+    :param model: rollup model class
+    :param keys: primary key values of the row
+    :param increments: amounts to add by column name
+    """
+    table = model.__table__
+    insert = postgresql.insert(table).values(**keys, **increments)
+    connection.SQL.session.execute(insert.on_conflict_do_update(  # pylint: disable=no-member
+        index_elements=list(keys),
+        set_={key: table.c[key] + insert.excluded[key] for key in increments}))
+
+
+def get_pending_spotify_track_ids(queue: models.Queues) -> list[str]:
+    """Fetch IDs of tracks staged in the outbox but not yet added to the host's Spotify queue.
+
+    :param queue: Mixify queue object
+    :return: list of Spotify track IDs
+    """
+    return [entry.spotify_track_id for entry in models.SpotifyOutbox.query.filter_by(
+        queue_id=queue.id, subscriber_id=None, sent_on_utc=None, failed_on_utc=None).all()]
+
+
+def get_public_queue_info(queue: models.Queues) -> dict:
+    """Build the part of a Mixify queue object that every visitor may see.
+
+    :param queue: Mixify queue object
+    :return: queue object without the host's access token and fingerprint
+    """
+    return {key: value for key, value in queue.as_dict().items()
+            if key not in PRIVATE_QUEUE_FIELDS}
+
+
+def _get_public_queue_song_info(queue_song: models.QueueSongs) -> dict:
+    """Build the part of a queue song object that every visitor may see.
+
+    :param queue_song: queue song object
+    :return: queue song object without the fingerprint of the visitor who added it
+    """
+    return {key: value for key, value in queue_song.as_dict().items()
+            if key not in PRIVATE_QUEUE_SONG_FIELDS}
+
+
 def get_queue_with_tracks(queue: models.Queues, fpjs_visitor_id: str) -> list:
     """Fetches the current Mixify queue with playback info.
 
+    The visitor-independent part is shared between concurrent requests through the snapshot
+    cache, then ownership flags, balance info and own upvotes are layered on for the current user.
+
     :param queue: Mixify queue object
-    :param fpjs_visitor_id: FingerprintJS visitor ID for balance calculation
+    :param fpjs_visitor_id: FingerprintJS visitor ID for ownership, balance and upvote flags
     :return: queue object with playback info
     """
-    queue_info = queue.as_dict()
+    snapshot = snapshots.get_or_build(
+        queue.id, queue.version, lambda: (_build_queue_snapshot(queue), queue.version))
+    queue_info = dict(snapshot)
+    queue_info['is_host'] = queue.started_by_fpjs_visitor_id == fpjs_visitor_id
+    queue_info['is_subscriber'] = models.QueueSubscribers.query.filter_by(
+        queue_id=queue.id, fpjs_visitor_id=fpjs_visitor_id).first() is not None
+
+    # If the current user is the queue creator, add balance info for them
+    queue_info['balance_info'] = None
+    if queue_info['is_host']:
+        func = connection.SQL.func
+        boost_totals = connection.SQL.session.query(  # pylint: disable=no-member
+            func.coalesce(func.sum(models.QueueSongBoosts.cost_usd), 0),
+            func.count(models.QueueSongBoosts.id),
+            func.count(connection.SQL.distinct(models.QueueSongBoosts.queue_id))).join(
+                models.Queues, models.Queues.id == models.QueueSongBoosts.queue_id).filter(
+                    models.Queues.spotify_user_id == queue.spotify_user_id)
+        boost_revenue, boost_count, queue_count = boost_totals.one()
+        queue_info['balance_info'] = {
+            'amount': float(boost_revenue) * (config.BOOST_HOST_PAYOUT_PERCENT / 100),
+            'queue_count': queue_count,
+            'boost_count': boost_count}
+
+    # Flag songs upvoted by the current user
+    visitor_upvotes = connection.SQL.session.query(  # pylint: disable=no-member
+        models.QueueSongUpvotes.queue_song_id).join(models.QueueSongs).filter(
+            models.QueueSongs.queue_id == queue.id,
+            models.QueueSongUpvotes.upvoted_by_fpjs_visitor_id == fpjs_visitor_id)
+    upvoted_queue_song_ids = {queue_song_id for (queue_song_id,) in visitor_upvotes.all()}
+
+    # Flag songs added by the current user
+    visitor_songs = connection.SQL.session.query(  # pylint: disable=no-member
+        models.QueueSongs.id).filter_by(queue_id=queue.id, added_by_fpjs_visitor_id=fpjs_visitor_id)
+    added_queue_song_ids = {queue_song_id for (queue_song_id,) in visitor_songs.all()}
+
+    for bucket in ('queued_songs', 'played_songs'):
+        queue_info[bucket] = [
+            {**queue_song_info,
+             'upvoted_by_me': queue_song_info['id'] in upvoted_queue_song_ids,
+             'added_by_me': queue_song_info['id'] in added_queue_song_ids}
+            for queue_song_info in snapshot[bucket]]
+
+    return queue_info
+
+
+def _build_queue_snapshot(queue: models.Queues) -> dict:
+    """Build the part of a Mixify queue with playback info that is the same for every user.
+
+    :param queue: Mixify queue object
+    :return: queue object with playback info, without visitor fingerprints, access tokens,
+        balance info or own upvotes
+    """
+    queue_info = get_public_queue_info(queue)
     queued_songs: list[dict] = []
     played_songs: list[dict] = []
     current_utc = datetime.datetime.utcnow()
 
     # Fetch Spotify playback info of host
-    playback_info = spotify.get_playback_info(queue.spotify_access_token)
+    # Without a usable host token, assume songs queued by Mixify are still in the Spotify queue
+    playback_info = None
+    if spotify_calls_allowed(queue):
+        try:
+            playback_info = spotify.get_playback_info(queue.spotify_access_token)
+        except spotify.AccessTokenError:
+            record_spotify_token_failure(queue)
+        else:
+            reset_spotify_token_failures(queue)
+    if playback_info is None:
+        playback_info = {
+            'current_track': None,
+            'currently_playing': None,
+            'queue': [queue_song.spotify_track_id for queue_song in models.QueueSongs.query.filter(
+                models.QueueSongs.queue_id == queue.id,
+                models.QueueSongs.added_to_spotify_queue_on_utc.isnot(None),
+                models.QueueSongs.played_on_utc.is_(None)).all()]}
     current_spotify_track_playing: str | None = playback_info['current_track']
-    current_spotify_queue_track_ids: list[str] = playback_info['queue']
+    current_spotify_queue_track_ids: list[str] = (
+        playback_info['queue'] + get_pending_spotify_track_ids(queue))
 
     # Fetch all songs in the Mixify queue
     # Handle newest song first to accurately identify currently playing entry
@@ -43,40 +336,25 @@ def get_queue_with_tracks(queue: models.Queues, fpjs_visitor_id: str) -> list:
         queue_id=queue.id).all()
     queue_songs.sort(key=lambda t: t.added_on_utc, reverse=True)
 
-    # If the current user is the queue creator, add balance info for them
-    queue_info['balance_info'] = None
-    if queue.started_by_fpjs_visitor_id == fpjs_visitor_id:
-        balance = 0.0
-        queue_count = 0
-        boost_count = 0
-        for users_queue in models.Queues.query.filter_by(
-                spotify_user_id=queue.spotify_user_id).all():
-            queue_has_boost = False
-            for queue_boost in models.QueueSongBoosts.query.filter_by(
-                    queue_id=users_queue.id).all():
-                balance += float(queue_boost.cost_usd) * (config.BOOST_HOST_PAYOUT_PERCENT / 100)
-                boost_count += 1
-                queue_has_boost = True
-            if queue_has_boost is True:
-                queue_count += 1
-        queue_info['balance_info'] = {
-            'amount': balance,
-            'queue_count': queue_count,
-            'boost_count': boost_count}
+    # Fetch upvote counts and boosts for all songs at once
+    upvote_counts: dict = dict(connection.SQL.session.query(  # pylint: disable=no-member
+        models.QueueSongUpvotes.queue_song_id,
+        connection.SQL.func.count(models.QueueSongUpvotes.id)).join(models.QueueSongs).filter(
+            models.QueueSongs.queue_id == queue.id).group_by(
+                models.QueueSongUpvotes.queue_song_id).all())
+    boosted_queue_song_ids = {
+        queue_song_boost.queue_song_id for queue_song_boost in
+        models.QueueSongBoosts.query.filter_by(queue_id=queue.id).all()}
 
     # Break songs in the Mixify queue into playback state buckets
     for queue_song in queue_songs:
-        queue_song_info = queue_song.as_dict()
-        queue_song_info['boosted'] = (
-            models.QueueSongBoosts.query.filter_by(queue_song_id=queue_song.id).first() is not None)
-        queue_song_info['upvotes']: list[str] = [
-            queue_song_upvote.upvoted_by_fpjs_visitor_id
-            for queue_song_upvote in models.QueueSongUpvotes.query.filter_by(
-                queue_song_id=queue_song.id).all()]
+        queue_song_info = _get_public_queue_song_info(queue_song)
+        queue_song_info['boosted'] = queue_song.id in boosted_queue_song_ids
+        queue_song_info['upvote_count'] = upvote_counts.get(queue_song.id, 0)
         if (queue_song.spotify_track_id == current_spotify_track_playing
                 and queue_song.added_to_spotify_queue_on_utc is not None):
-            queue_song.played_on_utc = current_utc
-            queue_song.save()
+            if queue_song.played_on_utc is None:
+                mark_queue_song_played(queue, queue_song, current_utc)
         elif (queue_song.added_to_spotify_queue_on_utc is not None
               and queue_song.spotify_track_id not in current_spotify_queue_track_ids):
             played_songs.append(queue_song_info)
@@ -95,15 +373,15 @@ def get_queue_with_tracks(queue: models.Queues, fpjs_visitor_id: str) -> list:
                         and queue_song.spotify_track_id in current_spotify_queue_track_ids):
                     current_spotify_queue_track_ids.remove(queue_song.spotify_track_id)
 
-    # Append queue subscribers
-    queue_info['subscribers'] = [
-        subscriber.as_dict() for subscriber in models.QueueSubscribers.query.filter_by(
-            queue_id=queue.id).all()]
+    # Count queue subscribers, whose fingerprints and access tokens stay private
+    queue_info['subscriber_count'] = models.QueueSubscribers.query.filter_by(
+        queue_id=queue.id).count()
 
     # Sort buckets for frontend queue display
     queued_songs.sort(key=lambda t: (
         t['added_to_spotify_queue_on_utc'] or current_utc,
-        1 - len(t['upvotes']),
+        not t['boosted'],
+        1 - t['upvote_count'],
         t['first_liked_on_utc'] or t['added_on_utc']))
     played_songs.sort(key=lambda t: t['added_to_spotify_queue_on_utc'], reverse=True)
     queue_info['queued_songs'] = queued_songs
@@ -120,3 +398,73 @@ def get_queue_with_tracks(queue: models.Queues, fpjs_visitor_id: str) -> list:
                 'currently_playing']['album']['images'][0]['url']}
 
     return queue_info
+
+
+def bump_queue_version(queue: models.Queues, commit: bool = True) -> None:
+    """Atomically increment the version of a Mixify queue after a mutation.
+
+    :param queue: Mixify queue object
+    :param commit: immediately commit operation to DB, defaults to True
+    """
+    queue.version = models.Queues.version + 1  # reloaded from DB on next access
+    queue.save(commit)
+    snapshots.invalidate(queue.id)
+
+
+def get_queue_ack(queue: models.Queues) -> dict:
+    """Build a compact acknowledgement of a queue-level mutation.
+
+    :param queue: Mixify queue object
+    :return: dict with queue version and pause state
+    """
+    return {
+        'queue_version': queue.version,
+        'paused_on_utc': queue.paused_on_utc}
+
+
+def get_queue_song_ack(queue_song: models.QueueSongs, fpjs_visitor_id: str) -> dict:
+    """Build a compact acknowledgement of a mutation on a song in a Mixify queue.
+
+    Avoids the Spotify playback fetch and full queue rebuild of get_queue_with_tracks.
+
+    :param queue_song: changed queue song
+    :param fpjs_visitor_id: FingerprintJS visitor ID of requester
+    :return: dict with changed song, its rank among unqueued songs and the queue version
+    """
+    queue_song_info = _get_public_queue_song_info(queue_song)
+    queue_song_info['added_by_me'] = queue_song.added_by_fpjs_visitor_id == fpjs_visitor_id
+    queue_song_info['upvote_count'] = models.QueueSongUpvotes.query.filter_by(
+        queue_song_id=queue_song.id).count()
+    queue_song_info['upvoted_by_me'] = models.QueueSongUpvotes.query.filter_by(
+        queue_song_id=queue_song.id,
+        upvoted_by_fpjs_visitor_id=fpjs_visitor_id).first() is not None
+    queue_song_info['boosted'] = models.QueueSongBoosts.query.filter_by(
+        queue_song_id=queue_song.id).first() is not None
+
+    # Rank songs waiting to be queued on Spotify the same way the manager picks the next song:
+    # boosted songs first, then by upvotes, then oldest first. Counted in a single query
+    rank: int | None = None
+    if queue_song.added_to_spotify_queue_on_utc is None and queue_song.played_on_utc is None:
+        upvote_count = connection.SQL.select(
+            connection.SQL.func.count(models.QueueSongUpvotes.id)).where(
+                models.QueueSongUpvotes.queue_song_id == models.QueueSongs.id).scalar_subquery()
+        boosted = connection.SQL.exists().where(
+            models.QueueSongBoosts.queue_song_id == models.QueueSongs.id)
+        ranked_ahead = connection.SQL.or_(
+            upvote_count > queue_song_info['upvote_count'],
+            connection.SQL.and_(upvote_count == queue_song_info['upvote_count'],
+                                models.QueueSongs.added_on_utc < queue_song.added_on_utc))
+        if queue_song_info['boosted']:
+            ranked_ahead = connection.SQL.and_(boosted, ranked_ahead)
+        else:
+            ranked_ahead = connection.SQL.or_(boosted, ranked_ahead)
+        rank = 1 + models.QueueSongs.query.filter(
+            models.QueueSongs.queue_id == queue_song.queue_id,
+            models.QueueSongs.added_to_spotify_queue_on_utc.is_(None),
+            models.QueueSongs.played_on_utc.is_(None),
+            ranked_ahead).count()
+
+    return {
+        'queue_song': queue_song_info,
+        'rank': rank,
+        'queue_version': queue_song.queue.version}
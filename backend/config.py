@@ -11,3 +11,32 @@ MAX_SEARCH_RESULTS = int(os.environ['MAX_SEARCH_RESULTS'])
 STRIPE_SECRET_KEY = os.environ['STRIPE_SECRET_KEY']
 BOOST_COST_USD = float(os.environ['BOOST_COST_USD'])
 BOOST_HOST_PAYOUT_PERCENT = float(os.environ['BOOST_HOST_PAYOUT_PERCENT'])
+SPOTIFY_TOKEN_MAX_FAILURES = int(os.environ.get('SPOTIFY_TOKEN_MAX_FAILURES', 5))
+SPOTIFY_TOKEN_BACKOFF_MINUTES = int(os.environ.get('SPOTIFY_TOKEN_BACKOFF_MINUTES', 1))
+SPOTIFY_RATE_LIMIT_PER_SECOND = float(os.environ.get('SPOTIFY_RATE_LIMIT_PER_SECOND', 10))
+SPOTIFY_RATE_LIMIT_BURST = float(os.environ.get('SPOTIFY_RATE_LIMIT_BURST', 20))
+SPOTIFY_RATE_LIMIT_BACKGROUND_RESERVE_PERCENT = float(
+    os.environ.get('SPOTIFY_RATE_LIMIT_BACKGROUND_RESERVE_PERCENT', 50))
+SPOTIFY_RATE_LIMIT_MAX_WAIT_SECONDS = float(
+    os.environ.get('SPOTIFY_RATE_LIMIT_MAX_WAIT_SECONDS', 5))
+MAX_BATCH_OPERATIONS = int(os.environ.get('MAX_BATCH_OPERATIONS', 50))
+SPOTIFY_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('SPOTIFY_OUTBOX_MAX_ATTEMPTS', 5))
+SPOTIFY_OUTBOX_RETRY_SECONDS = int(os.environ.get('SPOTIFY_OUTBOX_RETRY_SECONDS', 30))
+SPOTIFY_OUTBOX_DRAIN_LIMIT = int(os.environ.get('SPOTIFY_OUTBOX_DRAIN_LIMIT', 100))
+SPOTIFY_OUTBOX_RETENTION_HOURS = int(os.environ.get('SPOTIFY_OUTBOX_RETENTION_HOURS', 24))
+SPOTIFY_OUTBOX_EXIT_WAIT_SECONDS = float(os.environ.get('SPOTIFY_OUTBOX_EXIT_WAIT_SECONDS', 5))
+BOOST_PAYMENT_INTENT_TTL_MINUTES = int(os.environ.get('BOOST_PAYMENT_INTENT_TTL_MINUTES', 30))
+BOOST_PAYMENT_CANCEL_GRACE_MINUTES = int(
+    os.environ.get('BOOST_PAYMENT_CANCEL_GRACE_MINUTES', 10))
+QUEUE_SNAPSHOT_TTL_SECONDS = float(os.environ.get('QUEUE_SNAPSHOT_TTL_SECONDS', 2))
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 2))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com')
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH', '')
+# Staged songs can't be re-ranked, since Spotify queues can't be reordered, so songs beyond those
+# covering playback until the next manager run lose later votes. Raise only to avoid dead air
+MANAGER_LOOKAHEAD_SONGS = int(os.environ.get('MANAGER_LOOKAHEAD_SONGS', 1))
+MANAGER_INTERVAL_SECONDS = int(os.environ.get('MANAGER_INTERVAL_SECONDS', 60))
+SQL_QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 30))
+SQL_DUPLICATE_QUERY_THRESHOLD = int(os.environ.get('SQL_DUPLICATE_QUERY_THRESHOLD', 5))
+SQL_MANAGER_QUERY_BUDGET = int(os.environ.get('SQL_MANAGER_QUERY_BUDGET', 2000))
@@ -1,6 +1,7 @@
 """SQLAlchemy database connection module."""
 import flask
 import flask_sqlalchemy
+import sqlalchemy
 
 import config
 
@@ -15,9 +16,19 @@ def connect_to_db(app: flask.Flask) -> None:
     """
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SQLALCHEMY_DATABASE_URI'] = config.SQLALCHEMY_DATABASE_URI
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+    # One pooled connection per request thread. A thread calling Spotify briefly checks out a
+    # second connection for the rate limit governor while its session holds the first, and the
+    # background outbox drain thread needs its own session and governor connections
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_pre_ping': True,
+        'pool_size': config.WEB_THREADS,
+        'max_overflow': config.WEB_THREADS + 2}
     SQL.init_app(app)
 
     # Create new tables if necessary
     with app.app_context():
+        # Trigram index for local track search
+        SQL.session.execute(  # pylint: disable=no-member
+            sqlalchemy.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        SQL.session.commit()  # pylint: disable=no-member
         SQL.create_all()
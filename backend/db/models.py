@@ -9,7 +9,7 @@ from db import transactions
 from db.connection import SQL
 
 # Do not display these columns in request responses
-HIDE_COLUMNS = ['password', 'account_token']
+HIDE_COLUMNS = ['password', 'account_token', 'stripe_client_secret']
 
 
 class BaseModel(SQL.Model):  # type: ignore
@@ -57,6 +57,10 @@ class Queues(BaseModel):
     started_on_utc: datetime.datetime = SQL.Column(SQL.DateTime, nullable=False)
     paused_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
     ended_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+    spotify_token_failure_count: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    spotify_token_retry_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+    suspended_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+    version: int = SQL.Column(SQL.Integer, nullable=False, default=0)
 
 
 class QueueSubscribers(BaseModel):
@@ -131,3 +135,136 @@ class QueueSongBoosts(BaseModel):
 
     queue: Queues = SQL.relationship('Queues')
     queue_song: QueueSongs = SQL.relationship('QueueSongs')
+
+
+class QueueStats(BaseModel):
+    """Table of per-queue activity totals, maintained incrementally."""
+
+    __tablename__ = 'queue_stats'
+
+    queue_id: str = SQL.Column(UUID(as_uuid=True), SQL.ForeignKey(Queues.id), primary_key=True)
+    songs_added: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    songs_played: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    upvotes: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    boosts: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    revenue_usd: float = SQL.Column(SQL.Numeric, nullable=False, default=0)
+
+
+class HostStats(BaseModel):
+    """Table of per-host activity totals across all queues, maintained incrementally."""
+
+    __tablename__ = 'host_stats'
+
+    spotify_user_id: str = SQL.Column(SQL.Text, primary_key=True)
+    queues_started: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    songs_added: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    songs_played: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    upvotes: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    boosts: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    revenue_usd: float = SQL.Column(SQL.Numeric, nullable=False, default=0)
+
+
+class QueueContributorStats(BaseModel):
+    """Table of per-visitor activity totals in a queue, maintained incrementally."""
+
+    __tablename__ = 'queue_contributor_stats'
+
+    queue_id: str = SQL.Column(UUID(as_uuid=True), SQL.ForeignKey(Queues.id), primary_key=True)
+    fpjs_visitor_id: str = SQL.Column(SQL.Text, primary_key=True)
+    songs_added: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    upvotes: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    boosts: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    contributions: int = SQL.Column(SQL.Integer, nullable=False, default=0)  # sum of the above
+
+    __table_args__ = (
+        SQL.Index('ix_queue_contributor_stats_contributions', 'queue_id', 'contributions'),
+    )
+
+
+class BoostPaymentIntents(BaseModel):
+    """Table of Stripe payment intents created for boosts, reused while pending."""
+
+    __tablename__ = 'boost_payment_intents'
+
+    id: uuid.UUID = SQL.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    queue_song_id: str = SQL.Column(
+        UUID(as_uuid=True), SQL.ForeignKey(QueueSongs.id), nullable=False)
+    fpjs_visitor_id: str = SQL.Column(SQL.Text, nullable=False)
+    stripe_payment_intent_id: str = SQL.Column(SQL.Text, nullable=False)
+    stripe_client_secret: str = SQL.Column(SQL.Text, nullable=False)
+    cost_usd: float = SQL.Column(SQL.Numeric, nullable=False)
+    created_on_utc: datetime.datetime = SQL.Column(SQL.DateTime, nullable=False)
+    expires_on_utc: datetime.datetime = SQL.Column(SQL.DateTime, nullable=False)
+    used_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+    canceled_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+    stripe_canceled_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+
+    __table_args__ = (
+        SQL.Index('ix_boost_payment_intents_queue_song_visitor',
+                  'queue_song_id', 'fpjs_visitor_id'),
+    )
+
+    queue_song: QueueSongs = SQL.relationship('QueueSongs')
+
+
+class KnownTracks(BaseModel):
+    """Table of Spotify tracks previously added to any Mixify queue, indexed for local search."""
+
+    __tablename__ = 'known_tracks'
+
+    spotify_track_id: str = SQL.Column(SQL.Text, primary_key=True)
+    name: str = SQL.Column(SQL.Text, nullable=False)
+    artist: str = SQL.Column(SQL.Text, nullable=False)
+    album_cover_url: str = SQL.Column(SQL.Text, nullable=False)
+    duration_ms: int = SQL.Column(SQL.Integer, nullable=False)
+    explicit: bool | None = SQL.Column(SQL.Boolean)
+    search_text: str = SQL.Column(SQL.Text, nullable=False)  # lowercase name and artist
+    queued_count: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    last_queued_on_utc: datetime.datetime = SQL.Column(SQL.DateTime, nullable=False)
+
+    __table_args__ = (
+        SQL.Index('ix_known_tracks_search_text_trgm', 'search_text',
+                  postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}),
+    )
+
+
+class SpotifyRateLimits(BaseModel):
+    """Table of Spotify API token buckets shared by all app processes."""
+
+    __tablename__ = 'spotify_rate_limits'
+
+    id: str = SQL.Column(SQL.Text, primary_key=True)
+    tokens: float = SQL.Column(SQL.Float, nullable=False)
+    refilled_on_utc: datetime.datetime = SQL.Column(SQL.DateTime, nullable=False)
+    blocked_until_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+
+
+class SpotifyOutbox(BaseModel):
+    """Table of pending writes to Spotify queues, drained by background workers."""
+
+    __tablename__ = 'spotify_outbox'
+
+    id: uuid.UUID = SQL.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    queue_id: str = SQL.Column(UUID(as_uuid=True), SQL.ForeignKey(Queues.id), nullable=False)
+    queue_song_id: str = SQL.Column(
+        UUID(as_uuid=True), SQL.ForeignKey(QueueSongs.id), nullable=False)
+    subscriber_id: str | None = SQL.Column(UUID(as_uuid=True))  # None if target is queue host
+    spotify_track_id: str = SQL.Column(SQL.Text, nullable=False)
+    spotify_track_uri: str = SQL.Column(SQL.Text, nullable=False)
+    idempotency_key: str = SQL.Column(SQL.Text, nullable=False, unique=True)
+    created_on_utc: datetime.datetime = SQL.Column(SQL.DateTime, nullable=False)
+    attempt_count: int = SQL.Column(SQL.Integer, nullable=False, default=0)
+    next_attempt_on_utc: datetime.datetime = SQL.Column(SQL.DateTime, nullable=False)
+    last_error: str | None = SQL.Column(SQL.Text)
+    # Times the track was in the target Spotify queue before the latest attempt
+    spotify_queue_track_count: int | None = SQL.Column(SQL.Integer)
+    sent_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+    failed_on_utc: datetime.datetime | None = SQL.Column(SQL.DateTime)
+
+    __table_args__ = (
+        SQL.Index('ix_spotify_outbox_pending', 'sent_on_utc', 'failed_on_utc',
+                  'next_attempt_on_utc'),
+    )
+
+    queue: Queues = SQL.relationship('Queues')
+    queue_song: QueueSongs = SQL.relationship('QueueSongs')
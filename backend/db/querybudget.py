@@ -0,0 +1,133 @@
+"""SQL query budget tracking module.
+
+Counts the SQL statements executed within a scope, such as an API request or a queue manager
+run, and flags scopes that exceed their query budget or repeat the same statement shape, which
+usually means an N+1 query pattern.
+"""
+import collections
+import contextlib
+import contextvars
+import re
+import sys
+import typing
+import sqlalchemy
+import config
+
+# Matches bound parameter lists, e.g. expanded IN clauses
+_PARAM_LIST_PATTERN = re.compile(r'\(\s*%\(\w+\)s(\s*,\s*%\(\w+\)s)*\s*\)')
+_PARAM_PATTERN = re.compile(r'%\(\w+\)s')
+
+
+class QueryStats:
+    """Statements executed within a tracked scope."""
+
+    def __init__(self, name: str, budget: int | None, duplicate_threshold: int | None):
+        self.name = name
+        self.budget = budget
+        self.duplicate_threshold = duplicate_threshold
+        self.query_count = 0
+        self.shape_counts: collections.Counter = collections.Counter()
+
+    def offenses(self) -> list[str]:
+        """Describe how the scope exceeded its budget, if at all.
+
+        :return: list of offense descriptions
+        """
+        offenses = []
+        if self.budget is not None and self.query_count > self.budget:
+            offenses.append(f'{self.query_count} queries exceed budget of {self.budget}')
+        if self.duplicate_threshold is not None:
+            for shape, count in self.shape_counts.most_common():
+                if count <= self.duplicate_threshold:
+                    break
+                offenses.append(f'{count} executions of: {shape}')
+        return offenses
+
+
+_scopes: contextvars.ContextVar[tuple[QueryStats, ...]] = contextvars.ContextVar(
+    'query_budget_scopes', default=())
+
+
+@contextlib.contextmanager
+def track(name: str, budget: int | None = config.SQL_QUERY_BUDGET,
+          duplicate_threshold: int | None = config.SQL_DUPLICATE_QUERY_THRESHOLD
+          ) -> typing.Iterator[QueryStats]:
+    """Track the SQL statements executed within a scope, logging it if over budget.
+
+    Scopes may be nested, in which case statements count toward every enclosing scope.
+
+    :param name: scope name used in logs
+    :param budget: max statements, defaults to SQL_QUERY_BUDGET, None for no limit
+    :param duplicate_threshold: max executions of one statement shape, defaults to
+        SQL_DUPLICATE_QUERY_THRESHOLD, None for no limit
+    :return: stats of the scope
+    """
+    stats = QueryStats(name, budget, duplicate_threshold)
+    token = _scopes.set(_scopes.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _scopes.reset(token)
+        offenses = stats.offenses()
+        if offenses:
+            sys.stderr.write(f'{str({"query_budget": stats.name, "offenses": offenses})}\n')
+
+
+@contextlib.contextmanager
+def assert_within_budget(name: str, budget: int | None = config.SQL_QUERY_BUDGET,
+                         duplicate_threshold: int | None = config.SQL_DUPLICATE_QUERY_THRESHOLD
+                         ) -> typing.Iterator[QueryStats]:
+    """Track a scope and fail if it exceeds its budget, for use in tests.
+
+    :param name: scope name used in the failure message
+    :param budget: max statements, defaults to SQL_QUERY_BUDGET, None for no limit
+    :param duplicate_threshold: max executions of one statement shape, defaults to
+        SQL_DUPLICATE_QUERY_THRESHOLD, None for no limit
+    :raises AssertionError: if the scope exceeded its budget
+    :return: stats of the scope
+    """
+    with track(name, budget, duplicate_threshold) as stats:
+        yield stats
+    offenses = stats.offenses()
+    if offenses:
+        raise AssertionError(f'{name} exceeded query budget: {offenses}')
+
+
+def query_budget(budget: int | None,
+                 duplicate_threshold: int | None = config.SQL_DUPLICATE_QUERY_THRESHOLD
+                 ) -> typing.Callable:
+    """Override the request query budget of an API endpoint function.
+
+    :param budget: max statements, None for no limit
+    :param duplicate_threshold: max executions of one statement shape, None for no limit
+    :return: decorator
+    """
+    def decorator(endpoint_func: typing.Callable) -> typing.Callable:
+        endpoint_func.query_budget = budget
+        endpoint_func.duplicate_query_threshold = duplicate_threshold
+        return endpoint_func
+    return decorator
+
+
+def statement_shape(statement: str) -> str:
+    """Normalize a SQL statement so executions with different parameters compare equal.
+
+    :param statement: SQL statement with bound parameter placeholders
+    :return: normalized statement
+    """
+    shape = ' '.join(statement.split())
+    shape = _PARAM_LIST_PATTERN.sub('(?)', shape)
+    return _PARAM_PATTERN.sub('?', shape)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'before_cursor_execute')
+def _count_statement(  # pylint: disable=unused-argument
+        conn, cursor, statement, parameters, context, executemany):
+    """Count a statement toward every active scope."""
+    scopes = _scopes.get()
+    if not scopes:
+        return
+    shape = statement_shape(statement)
+    for stats in scopes:
+        stats.query_count += 1
+        stats.shape_counts[shape] += 1
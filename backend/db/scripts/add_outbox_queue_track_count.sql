@@ -0,0 +1,3 @@
+\c mixify
+
+ALTER TABLE spotify_outbox ADD COLUMN IF NOT EXISTS spotify_queue_track_count INTEGER;
@@ -0,0 +1,5 @@
+\c mixify
+
+ALTER TABLE queues ADD COLUMN IF NOT EXISTS spotify_token_failure_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE queues ADD COLUMN IF NOT EXISTS spotify_token_retry_on_utc TIMESTAMP;
+ALTER TABLE queues ADD COLUMN IF NOT EXISTS suspended_on_utc TIMESTAMP;
@@ -0,0 +1,3 @@
+\c mixify
+
+ALTER TABLE queues ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,13 @@
+\c mixify
+
+INSERT INTO known_tracks (
+    spotify_track_id, name, artist, album_cover_url, duration_ms, search_text, queued_count,
+    last_queued_on_utc)
+SELECT DISTINCT ON (spotify_track_id)
+    spotify_track_id, name, artist, album_cover_url, duration_ms,
+    lower(name || ' ' || artist),
+    count(*) OVER (PARTITION BY spotify_track_id),
+    max(added_on_utc) OVER (PARTITION BY spotify_track_id)
+FROM queue_songs
+ORDER BY spotify_track_id, added_on_utc DESC
+ON CONFLICT (spotify_track_id) DO NOTHING;
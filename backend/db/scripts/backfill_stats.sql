@@ -0,0 +1,40 @@
+\c mixify
+
+INSERT INTO queue_stats (queue_id, songs_added, songs_played, upvotes, boosts, revenue_usd)
+SELECT
+    q.id,
+    (SELECT count(*) FROM queue_songs s WHERE s.queue_id = q.id),
+    (SELECT count(*) FROM queue_songs s WHERE s.queue_id = q.id AND s.played_on_utc IS NOT NULL),
+    (SELECT count(*) FROM queue_song_upvotes u
+        JOIN queue_songs s ON s.id = u.queue_song_id WHERE s.queue_id = q.id),
+    (SELECT count(*) FROM queue_song_boosts b WHERE b.queue_id = q.id),
+    (SELECT coalesce(sum(b.cost_usd), 0) FROM queue_song_boosts b WHERE b.queue_id = q.id)
+FROM queues q
+ON CONFLICT (queue_id) DO NOTHING;
+
+INSERT INTO host_stats (
+    spotify_user_id, queues_started, songs_added, songs_played, upvotes, boosts, revenue_usd)
+SELECT q.spotify_user_id, count(*), sum(qs.songs_added), sum(qs.songs_played), sum(qs.upvotes),
+    sum(qs.boosts), sum(qs.revenue_usd)
+FROM queues q
+JOIN queue_stats qs ON qs.queue_id = q.id
+GROUP BY q.spotify_user_id
+ON CONFLICT (spotify_user_id) DO NOTHING;
+
+INSERT INTO queue_contributor_stats (
+    queue_id, fpjs_visitor_id, songs_added, upvotes, boosts, contributions)
+SELECT queue_id, fpjs_visitor_id, sum(songs_added), sum(upvotes), sum(boosts),
+    sum(songs_added) + sum(upvotes) + sum(boosts)
+FROM (
+    SELECT queue_id, added_by_fpjs_visitor_id AS fpjs_visitor_id,
+        1 AS songs_added, 0 AS upvotes, 0 AS boosts
+    FROM queue_songs
+    UNION ALL
+    SELECT s.queue_id, u.upvoted_by_fpjs_visitor_id, 0, 1, 0
+    FROM queue_song_upvotes u JOIN queue_songs s ON s.id = u.queue_song_id
+    UNION ALL
+    SELECT queue_id, boosted_by_fpjs_visitor_id, 0, 0, 1
+    FROM queue_song_boosts
+) contributions
+GROUP BY queue_id, fpjs_visitor_id
+ON CONFLICT (queue_id, fpjs_visitor_id) DO NOTHING;
@@ -1,5 +1,12 @@
 \c mixify
 
+DROP TABLE queue_contributor_stats CASCADE;
+DROP TABLE queue_stats CASCADE;
+DROP TABLE host_stats CASCADE;
+DROP TABLE known_tracks CASCADE;
+DROP TABLE boost_payment_intents CASCADE;
+DROP TABLE spotify_outbox CASCADE;
+DROP TABLE spotify_rate_limits CASCADE;
 DROP TABLE queue_song_upvotes CASCADE;
 DROP TABLE queue_songs CASCADE;
 DROP TABLE queue_subscribers CASCADE;
@@ -0,0 +1,39 @@
+"""Gunicorn production server configuration.
+
+Run from the backend directory with `gunicorn -c gunicorn.conf.py app:app`.
+"""
+# Every module-level name is read as a Gunicorn setting, and `config` is one of them
+import config as mixify_config
+
+# Preload the app once in the master so workers fork with it ready
+preload_app = True
+
+# Requests mostly wait on Spotify, Stripe and the database, so each worker serves requests on a
+# pool of threads. Threads in a worker also share its queue snapshot cache.
+worker_class = 'gthread'
+workers = mixify_config.WEB_WORKERS
+threads = mixify_config.WEB_THREADS
+
+# Spotify requests time out after 30 seconds and a manager run can make many of them
+timeout = 120
+
+# On shutdown, let in-flight requests (including manager runs) finish before workers exit
+graceful_timeout = 60
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Drop database connections inherited from the preloaded app in each new worker."""
+    from app import app  # pylint: disable=import-outside-toplevel
+    from db import connection  # pylint: disable=import-outside-toplevel
+    with app.app_context():
+        connection.SQL.engine.dispose()
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Give background outbox drains a short, fixed time to finish before a worker exits.
+
+    Runs after in-flight requests, which may have used up most of graceful_timeout already.
+    """
+    from api import outbox  # pylint: disable=import-outside-toplevel
+    outbox.wait_for_background_drains(
+        min(mixify_config.SPOTIFY_OUTBOX_EXIT_WAIT_SECONDS, graceful_timeout))
@@ -0,0 +1,23 @@
+"""Shared setup for Mixify API tests.
+
+Tests need a disposable Postgres database with pg_trgm available in TEST_DATABASE_URL, since the
+app connects to its database on import. Without one, no tests are collected.
+"""
+import os
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+# Test modules import the app, so skip collecting them without a test database
+collect_ignore_glob = [] if TEST_DATABASE_URL else ['test_*.py']
+
+# Configure the app for the test database before test modules import it
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+for key, value in {
+        'SECRET_KEY': 'test',
+        'QUEUE_MANAGER_TOKEN': 'test',
+        'MAX_SEARCH_RESULTS': '10',
+        'STRIPE_SECRET_KEY': 'test',
+        'BOOST_COST_USD': '1',
+        'BOOST_HOST_PAYOUT_PERCENT': '50'}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,137 @@
+"""Query budget tests for hot Mixify API endpoints.
+
+Fail when an endpoint exceeds SQL_QUERY_BUDGET statements or repeats a statement shape more than
+SQL_DUPLICATE_QUERY_THRESHOLD times, which usually means an N+1 query pattern. Spotify is
+stubbed, and the test database is configured in conftest.py.
+"""
+import datetime
+import uuid
+import pytest
+import app as mixify_app
+from api import snapshots
+from api import spotify
+from api.controllers import queue_controller
+from db import models
+from db import querybudget
+
+# Songs in the seeded queue, enough for N+1 patterns to exceed the duplicate threshold
+SONG_COUNT = 20
+UPVOTERS_PER_SONG = 3
+HOST_VISITOR_ID = 'host-visitor'
+GUEST_VISITOR_ID = 'guest-visitor'
+
+
+def _track(spotify_track_id: str) -> dict:
+    """Build a Spotify track object.
+
+    :param spotify_track_id: Track ID of song on Spotify
+    :return: dict with track info
+    """
+    return {
+        'id': spotify_track_id,
+        'name': f'Song {spotify_track_id}',
+        'uri': f'spotify:track:{spotify_track_id}',
+        'artists': [{'name': 'Artist'}],
+        'album': {'images': [{'url': 'https://example.com/cover.jpg'}]},
+        'duration_ms': 180000,
+        'explicit': False}
+
+
+@pytest.fixture(name='app_context', autouse=True)
+def fixture_app_context():
+    """Run each test in its own app context, and so its own database session."""
+    with mixify_app.app.app_context():
+        yield
+
+
+@pytest.fixture(name='queue')
+def fixture_queue(monkeypatch) -> models.Queues:
+    """Seed a queue with upvoted, boosted, staged and played songs, and stub Spotify playback.
+
+    The host is playing the first staged song, which has not been flagged as played yet.
+    """
+    current_utc = datetime.datetime.utcnow()
+    queue = models.Queues(
+        id=uuid.uuid4(),
+        name=f'test-{uuid.uuid4().hex[:12]}',
+        spotify_user_id=f'user-{uuid.uuid4().hex}',
+        spotify_access_token='host-token',
+        started_by_fpjs_visitor_id=HOST_VISITOR_ID,
+        started_on_utc=current_utc).save(commit=False)
+    models.QueueSubscribers(
+        queue_id=queue.id,
+        spotify_access_token='subscriber-token',
+        fpjs_visitor_id='subscriber-visitor',
+        subscribed_on_utc=current_utc).save(commit=False)
+
+    queue_songs = []
+    for song_index in range(SONG_COUNT):
+        track_info = _track(f'track-{song_index}')
+        queue_song = models.QueueSongs(
+            id=uuid.uuid4(),
+            queue_id=queue.id,
+            name=track_info['name'],
+            artist='Artist',
+            album_cover_url='https://example.com/cover.jpg',
+            duration_ms=track_info['duration_ms'],
+            spotify_track_id=track_info['id'],
+            spotify_track_uri=track_info['uri'],
+            added_by_fpjs_visitor_id=f'visitor-{song_index}',
+            added_on_utc=current_utc - datetime.timedelta(minutes=SONG_COUNT - song_index),
+            added_to_spotify_queue_on_utc=current_utc if song_index < 4 else None,
+            played_on_utc=current_utc if song_index < 2 else None).save(commit=False)
+        for upvoter_index in range(UPVOTERS_PER_SONG):
+            models.QueueSongUpvotes(
+                queue_song_id=queue_song.id,
+                upvoted_by_fpjs_visitor_id=f'upvoter-{upvoter_index}',
+                upvoted_on_utc=current_utc).save(commit=False)
+        if song_index % 5 == 0:
+            models.QueueSongBoosts(
+                queue_id=queue.id,
+                queue_song_id=queue_song.id,
+                boosted_by_fpjs_visitor_id=f'upvoter-{song_index}',
+                cost_usd=1).save(commit=False)
+        queue_songs.append(queue_song)
+    queue.save()
+
+    monkeypatch.setattr(spotify, 'get_playback_info', lambda access_token: {
+        'current_track': queue_songs[2].spotify_track_id,
+        'currently_playing': _track(queue_songs[2].spotify_track_id),
+        'queue': [queue_songs[3].spotify_track_id]})
+    monkeypatch.setattr(
+        spotify, 'get_track', lambda access_token, spotify_track_id: _track(spotify_track_id))
+    snapshots.invalidate(queue.id)  # measure a cold snapshot build
+    return queue
+
+
+@pytest.mark.parametrize('fpjs_visitor_id', [HOST_VISITOR_ID, GUEST_VISITOR_ID])
+def test_fetch_queue(queue, fpjs_visitor_id):
+    """Test fetching a queue as its host and as a guest stays within budget."""
+    with querybudget.assert_within_budget('fetch_queue'):
+        queue_info = queue_controller.fetch_queue(queue.name, fpjs_visitor_id)
+    assert len(queue_info['queued_songs']) == SONG_COUNT - 3
+    assert queue_info['is_host'] == (fpjs_visitor_id == HOST_VISITOR_ID)
+    assert 'spotify_access_token' not in queue_info
+    assert 'started_by_fpjs_visitor_id' not in queue_info
+    assert 'added_by_fpjs_visitor_id' not in queue_info['queued_songs'][0]
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_upvote_song(queue, compact):
+    """Test upvoting a song stays within budget."""
+    queue_song = models.QueueSongs.query.filter_by(
+        queue_id=queue.id, added_to_spotify_queue_on_utc=None).first()
+    with querybudget.assert_within_budget('upvote_song'):
+        queue_controller.upvote_song(str(queue_song.id), GUEST_VISITOR_ID, compact)
+    assert models.QueueSongUpvotes.query.filter_by(
+        queue_song_id=queue_song.id, upvoted_by_fpjs_visitor_id=GUEST_VISITOR_ID).count() == 1
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_add_song_to_queue(queue, compact):
+    """Test adding a song stays within budget."""
+    with querybudget.assert_within_budget('add_song_to_queue'):
+        queue_controller.add_song_to_queue(
+            str(queue.id), 'new-track', GUEST_VISITOR_ID, compact)
+    assert models.QueueSongs.query.filter_by(
+        queue_id=queue.id, spotify_track_id='new-track').count() == 1
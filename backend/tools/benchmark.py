@@ -0,0 +1,71 @@
+"""Mixify API load benchmark.
+
+Polls a queue the way guests do and reports throughput and latency, to compare server
+configurations. Example:
+
+    python tools/benchmark.py http://localhost:8000 abc123 --clients 200 --seconds 30
+"""
+import argparse
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+
+def run(api_url: str, queue_name: str, clients: int, seconds: float, poll_interval: float) -> dict:
+    """Poll a queue from many simulated guests at once.
+
+    :param api_url: base URL of the Mixify API
+    :param queue_name: name of queue to poll
+    :param clients: number of concurrent simulated guests
+    :param seconds: duration of the benchmark
+    :param poll_interval: seconds each guest waits between polls
+    :return: dict with request counts and latency percentiles
+    """
+    latencies: list[float] = []
+    errors: list[str] = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def _poll():
+        url = f'{api_url}/v1/queue/{queue_name}/benchmark-{uuid.uuid4()}'
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                with urllib.request.urlopen(url, timeout=60) as resp:
+                    resp.read()
+            except (urllib.error.URLError, TimeoutError) as error:
+                with lock:
+                    errors.append(str(error))
+            else:
+                with lock:
+                    latencies.append(time.monotonic() - started)
+            time.sleep(poll_interval)
+
+    guests = [threading.Thread(target=_poll) for _ in range(clients)]
+    for guest in guests:
+        guest.start()
+    for guest in guests:
+        guest.join()
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / seconds,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('api_url')
+    parser.add_argument('queue_name')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--poll-interval', type=float, default=1)
+    args = parser.parse_args()
+    print(run(args.api_url, args.queue_name, args.clients, args.seconds, args.poll_interval))
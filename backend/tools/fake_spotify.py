@@ -0,0 +1,155 @@
+"""Fake Spotify API for replaying captured Mixify traffic.
+
+Serves the Spotify endpoints Mixify uses from the tracks, users and search results in a traffic
+capture, and simulates each host's player: queued tracks play in order and advance by their
+duration, sped up by --speed to match the replay. Point the Mixify API at it with
+SPOTIFY_API_URL. Example:
+
+    python tools/fake_spotify.py capture.jsonl --port 9000 --speed 10
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.parse
+import flask
+
+app = flask.Flask(__name__)
+
+_catalog: dict[str, dict] = {}  # track ID to track
+_users: dict[str, dict] = {}  # token to user
+_searches: dict[str, list[dict]] = {}  # query to search results
+_players: dict[str, dict] = {}  # token to simulated player
+_players_lock = threading.Lock()
+_settings = {'speed': 1.0, 'latency_seconds': 0.0}
+
+
+def load_capture(capture_path: str) -> None:
+    """Seed fake Spotify data from the Spotify calls in a traffic capture.
+
+    :param capture_path: path of capture file
+    """
+    latencies: list[float] = []
+    with open(capture_path, encoding='utf-8') as capture_file:
+        for line in capture_file:
+            event = json.loads(line)
+            if event['kind'] != 'spotify' or event['body'] is None:
+                continue
+            latencies.append(event['duration_ms'] / 1000)
+            body = event['body']
+            if event['path'] == '/v1/me':
+                _users[event['token']] = body
+            elif event['path'].startswith('/v1/tracks/'):
+                _remember_tracks([body])
+            elif event['path'] == '/v1/search':
+                query = urllib.parse.parse_qs(event['query']).get('q', [''])[0]
+                _searches[query] = body['tracks']['items']
+                _remember_tracks(body['tracks']['items'])
+            elif event['path'] == '/v1/me/player/queue' and event['method'] == 'GET':
+                _remember_tracks([body['currently_playing'], *body['queue']])
+    if latencies:
+        _settings['latency_seconds'] = statistics.median(latencies)
+
+
+def _remember_tracks(tracks: list[dict | None]) -> None:
+    """Add tracks to the catalog.
+
+    :param tracks: Spotify track objects
+    """
+    for track in tracks:
+        if track is not None and track.get('id') is not None:
+            _catalog[track['id']] = track
+
+
+def _token() -> str:
+    """Fetch the access token of the current request.
+
+    :return: access token
+    """
+    time.sleep(_settings['latency_seconds'])  # simulate Spotify response time
+    return flask.request.headers.get('Authorization', '').removeprefix('Bearer ')
+
+
+def _advance_player(player: dict) -> None:
+    """Move a simulated player forward to the current time. Caller must hold the lock.
+
+    :param player: simulated player
+    """
+    now = time.monotonic()
+    while player['currently_playing'] is not None:
+        duration_seconds = player['currently_playing']['duration_ms'] / 1000 / _settings['speed']
+        if now - player['started_at'] < duration_seconds:
+            break
+        player['started_at'] += duration_seconds
+        player['currently_playing'] = player['queue'].pop(0) if player['queue'] else None
+    if player['currently_playing'] is None and player['queue']:
+        player['currently_playing'] = player['queue'].pop(0)
+        player['started_at'] = now
+
+
+@app.route('/v1/me', methods=['GET'])
+def get_user():
+    """Fake current user endpoint."""
+    token = _token()
+    return _users.get(token, {'id': token})
+
+
+@app.route('/v1/tracks/<track_id>', methods=['GET'])
+def get_track(track_id: str):
+    """Fake track endpoint."""
+    _token()
+    if track_id not in _catalog:
+        return {'error': {'status': 404, 'message': 'Non existing id'}}, 404
+    return _catalog[track_id]
+
+
+@app.route('/v1/search', methods=['GET'])
+def search():
+    """Fake search endpoint, answering uncaptured queries from the catalog."""
+    _token()
+    query = flask.request.args.get('q', '')
+    items = _searches.get(query)
+    if items is None:
+        items = [track for track in _catalog.values() if query.lower() in track['name'].lower()]
+    return {'tracks': {'items': items}}
+
+
+@app.route('/v1/me/player/queue', methods=['GET'])
+def get_queue():
+    """Fake player queue endpoint."""
+    token = _token()
+    with _players_lock:
+        player = _players.setdefault(
+            token, {'currently_playing': None, 'queue': [], 'started_at': time.monotonic()})
+        _advance_player(player)
+        return {'currently_playing': player['currently_playing'], 'queue': list(player['queue'])}
+
+
+@app.route('/v1/me/player/queue', methods=['POST'])
+def add_to_queue():
+    """Fake add to player queue endpoint."""
+    token = _token()
+    track_id = flask.request.args.get('uri', '').rsplit(':', 1)[-1]
+    if track_id not in _catalog:
+        return {'error': {'status': 400, 'message': 'Invalid track uri'}}, 400
+    with _players_lock:
+        player = _players.setdefault(
+            token, {'currently_playing': None, 'queue': [], 'started_at': time.monotonic()})
+        _advance_player(player)
+        player['queue'].append(_catalog[track_id])
+    return '', 204
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('capture_path')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--speed', type=float, default=1, help='playback speed multiplier')
+    parser.add_argument('--latency-ms', type=float, help='defaults to median captured latency')
+    args = parser.parse_args()
+    load_capture(args.capture_path)
+    _settings['speed'] = args.speed
+    if args.latency_ms is not None:
+        _settings['latency_seconds'] = args.latency_ms / 1000
+    app.run(port=args.port, threaded=True)
@@ -0,0 +1,245 @@
+"""Replay captured Mixify traffic for capacity planning.
+
+Sends the API requests from a traffic capture to a Mixify API at N times the captured speed and
+reports throughput and latency per endpoint. Queue and song IDs created during the replay are
+mapped onto the captured IDs, so the capture must start before the queues it uses are created.
+Run the target API with SPOTIFY_API_URL pointing at tools/fake_spotify.py. Boost payment requests
+are skipped so replays never create Stripe payment intents. Example:
+
+    python tools/replay.py capture.jsonl http://localhost:8000 --speed 10 --manager-token secret
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Path parameters holding IDs created by the API
+MAPPED_PARAMS = ('queue_id', 'queue_song_id', 'queue_name')
+
+# Endpoints not replayed because they call Stripe, which has no fake
+SKIPPED_ENDPOINTS = ('create_boost_payment',)
+
+
+class IdMap:
+    """Thread-safe mapping of captured IDs to IDs created during replay."""
+
+    def __init__(self):
+        self._ids: dict[str, str] = {}
+        self._changed = threading.Condition()
+
+    def add(self, captured_id: str | None, replayed_id: str | None) -> None:
+        """Map a captured ID to a replayed ID.
+
+        :param captured_id: ID in the capture
+        :param replayed_id: ID created during replay
+        """
+        if captured_id is None or replayed_id is None:
+            return
+        with self._changed:
+            self._ids[str(captured_id)] = str(replayed_id)
+            self._changed.notify_all()
+
+    def get(self, captured_id: str, timeout_seconds: float) -> str | None:
+        """Fetch the replayed ID for a captured ID, waiting for it to be created.
+
+        :param captured_id: ID in the capture
+        :param timeout_seconds: max seconds to wait
+        :return: replayed ID, or None if it was never created
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: captured_id in self._ids, timeout_seconds)
+            return self._ids.get(captured_id)
+
+
+def load_requests(capture_path: str) -> list[dict]:
+    """Load captured API requests in order.
+
+    :param capture_path: path of capture file
+    :return: list of request events
+    """
+    with open(capture_path, encoding='utf-8') as capture_file:
+        events = [json.loads(line) for line in capture_file]
+    return sorted([event for event in events if event['kind'] == 'request'],
+                  key=lambda event: event['ts'])
+
+
+def find_added_song_id(response: dict, spotify_track_id: str) -> str | None:
+    """Find the ID of the song added by an add_song_to_queue response.
+
+    :param response: full queue or compact acknowledgement response
+    :param spotify_track_id: Track ID of added song on Spotify
+    :return: queue song ID
+    """
+    if 'queue_song' in response:
+        return response['queue_song']['id']
+    songs = [song for song in response.get('queued_songs', []) + response.get('played_songs', [])
+             if song['spotify_track_id'] == spotify_track_id]
+    return max(songs, key=lambda song: song['added_on_utc'])['id'] if songs else None
+
+
+def remember_ids(id_map: IdMap, event: dict, response: dict) -> None:
+    """Map IDs created by a replayed request onto the captured IDs.
+
+    :param id_map: ID mapping
+    :param event: captured request event
+    :param response: replayed response
+    """
+    captured = event['response']
+    if not captured or 'error_message' in captured or 'error_message' in response:
+        return
+    if event['endpoint'] == 'create_queue':
+        id_map.add(captured['id'], response['id'])
+        id_map.add(captured['name'], response['name'])
+    elif event['endpoint'] == 'add_song_to_queue':
+        track_id = event['path_args']['spotify_track_id']
+        id_map.add(find_added_song_id(captured, track_id), find_added_song_id(response, track_id))
+    elif event['endpoint'] == 'apply_batch':
+        for captured_result, result in zip(captured['results'], response['results']):
+            id_map.add(captured_result.get('queue_song_id'), result.get('queue_song_id'))
+
+
+def map_body(body: dict | None, id_map: IdMap, mapping_timeout: float) -> dict | None:
+    """Map the queue song IDs referenced by batch operations onto replayed IDs.
+
+    :param body: captured request body
+    :param id_map: ID mapping
+    :param mapping_timeout: max seconds to wait for a referenced ID to be created
+    :raises KeyError: if a referenced ID was never created
+    :return: request body with replayed IDs
+    """
+    if not isinstance(body, dict) or not isinstance(body.get('operations'), list):
+        return body
+    operations = []
+    for operation in body['operations']:
+        if isinstance(operation, dict) and operation.get('queue_song_id') is not None:
+            queue_song_id = id_map.get(str(operation['queue_song_id']), mapping_timeout)
+            if queue_song_id is None:
+                raise KeyError(operation['queue_song_id'])
+            operation = {**operation, 'queue_song_id': queue_song_id}
+        operations.append(operation)
+    return {**body, 'operations': operations}
+
+
+def send(api_url: str, event: dict, id_map: IdMap, manager_token: str,
+         mapping_timeout: float) -> tuple[str, float | None, int]:
+    """Send a captured request to the target API.
+
+    :param api_url: base URL of target Mixify API
+    :param event: captured request event
+    :param id_map: ID mapping
+    :param manager_token: queue manager token of target API
+    :param mapping_timeout: max seconds to wait for a referenced ID to be created
+    :return: outcome (`ok`, `error`, `unmapped` or `skipped`), latency in seconds and number of
+        failed batch operations
+    """
+    if event['endpoint'] in SKIPPED_ENDPOINTS:
+        return 'skipped', None, 0
+    path = event['rule']
+    for key, value in event['path_args'].items():
+        if key in MAPPED_PARAMS:
+            value = id_map.get(value, mapping_timeout)
+            if value is None:
+                return 'unmapped', None, 0
+        elif key == 'token':
+            value = manager_token
+        path = path.replace(f'<{key}>', urllib.parse.quote(str(value), safe=''))
+    url = api_url + path
+    if event['query_args']:
+        url += '?' + urllib.parse.urlencode(event['query_args'])
+    try:
+        body = map_body(event['body'], id_map, mapping_timeout)
+    except KeyError:
+        return 'unmapped', None, 0
+    data = None if body is None else json.dumps(body).encode()
+    request = urllib.request.Request(
+        url, data=data, method=event['method'], headers={'Content-Type': 'application/json'})
+
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as resp:
+            response = json.loads(resp.read())
+    except urllib.error.HTTPError as error:
+        response = json.loads(error.read() or b'{}')
+    except (urllib.error.URLError, TimeoutError, ValueError):
+        return 'error', None, 0
+    latency = time.monotonic() - started
+    remember_ids(id_map, event, response)
+    operation_errors = sum(1 for result in response.get('results', [])
+                           if isinstance(result, dict) and 'error_message' in result)
+    return ('error' if 'error_message' in response else 'ok'), latency, operation_errors
+
+
+def replay(capture_path: str, api_url: str, speed: float, manager_token: str,
+           max_concurrency: int, mapping_timeout: float) -> dict:
+    """Replay a traffic capture against a Mixify API.
+
+    :param capture_path: path of capture file
+    :param api_url: base URL of target Mixify API
+    :param speed: replay speed multiplier
+    :param manager_token: queue manager token of target API
+    :param max_concurrency: max requests in flight
+    :param mapping_timeout: max seconds to wait for a referenced ID to be created
+    :return: dict with overall and per-endpoint results
+    """
+    events = load_requests(capture_path)
+    if not events:
+        return {}
+    id_map = IdMap()
+    outcomes: dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+    latencies: dict[str, list[float]] = collections.defaultdict(list)
+    first_ts = events[0]['ts']
+    started = time.monotonic()
+
+    with concurrent.futures.ThreadPoolExecutor(max_concurrency) as executor:
+        futures = {}
+        for event in events:
+            delay = (event['ts'] - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            futures[executor.submit(
+                send, api_url, event, id_map, manager_token, mapping_timeout)] = event
+        for future in concurrent.futures.as_completed(futures):
+            endpoint = futures[future]['endpoint']
+            outcome, latency, operation_errors = future.result()
+            outcomes[endpoint][outcome] += 1
+            if operation_errors:
+                outcomes[endpoint]['operation_errors'] += operation_errors
+            if latency is not None:
+                latencies[endpoint].append(latency)
+
+    elapsed = time.monotonic() - started
+    captured_duration = events[-1]['ts'] - first_ts
+    results = {
+        'requests': len(events),
+        'elapsed_seconds': elapsed,
+        'requests_per_second': len(events) / elapsed if elapsed else None,
+        'achieved_speed': captured_duration / elapsed if elapsed else None,
+        'endpoints': {}}
+    for endpoint, endpoint_outcomes in outcomes.items():
+        endpoint_latencies = sorted(latencies[endpoint])
+        results['endpoints'][endpoint] = {
+            **endpoint_outcomes,
+            'p50_ms': (statistics.median(endpoint_latencies) * 1000
+                       if endpoint_latencies else None),
+            'p95_ms': (endpoint_latencies[int(len(endpoint_latencies) * 0.95)] * 1000
+                       if endpoint_latencies else None)}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('capture_path')
+    parser.add_argument('api_url')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed multiplier')
+    parser.add_argument('--manager-token', default='', help='QUEUE_MANAGER_TOKEN of target')
+    parser.add_argument('--max-concurrency', type=int, default=256)
+    parser.add_argument('--mapping-timeout', type=float, default=30)
+    args = parser.parse_args()
+    print(json.dumps(replay(args.capture_path, args.api_url, args.speed, args.manager_token,
+                            args.max_concurrency, args.mapping_timeout), indent=2))
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { notifications } from '@mantine/notifications';
 import { useOutletContext, useParams, useNavigate } from 'react-router-dom';
 import { fetchQueue, endQueue, pauseQueue, unpauseQueue, removeSongUpvote, upvoteSong, searchForSong, addSongToQueue, QUEUE_NOT_FOUND_ERROR_MSG, unsubscribeFromQueue, boostQueueSong, createBoostPayment } from '../services';
@@ -7,13 +7,13 @@ import { IconSearch, IconThumbUp, IconPlayerPauseFilled, IconPlayerStopFilled, I
 import { useStripe, useElements, ExpressCheckoutElement } from '@stripe/react-stripe-js';
 import spotifyLogo from '../assets/spotify-logo.png';
 
-const useDebounce = (value) => {
+const useDebounce = (value, delay = 1000) => {
     const [debouncedValue, setDebouncedValue] = useState(value);
 
     useEffect(() => {
-        const handler = setTimeout(() => setDebouncedValue(value), 1000);
+        const handler = setTimeout(() => setDebouncedValue(value), delay);
         return () => clearTimeout(handler);
-    }, [value]);
+    }, [value, delay]);
 
     return debouncedValue;
 };
@@ -29,7 +29,11 @@ export const QueuePage = () => {
     const [queueError, setQueueError] = useState('');
     const [searchQuery, setSearchQuery] = useState('');
     const [searchResults, setSearchResults] = useState([]);
+    const typeaheadSearchQuery = useDebounce(searchQuery, 250);
     const debouncedSearchQuery = useDebounce(searchQuery);
+    const latestSearchQuery = useRef(searchQuery);
+    latestSearchQuery.current = searchQuery;
+    const spotifyResultsQuery = useRef('');  // query whose Spotify results are shown
 
     const [endButtonLoading, setEndButtonLoading] = useState(false);
     const [pauseButtonLoading, setPauseButtonLoading] = useState(false);
@@ -67,7 +71,7 @@ export const QueuePage = () => {
         try {
             const queue = await fetchQueue(queueName, context.visitorId);
             setQueue(queue);
-            if (queue.started_by_fpjs_visitor_id === context.visitorId) {
+            if (queue.is_host) {
                 context.setBalanceInfo(queue.balance_info);
             }
         } catch (error) {
@@ -163,7 +167,7 @@ export const QueuePage = () => {
         try {
             const newQueue = await boostQueueSong(boostingQueueSong.id, context.visitorId);
             setQueue(newQueue);
-            if (newQueue.started_by_fpjs_visitor_id === context.visitorId) {
+            if (newQueue.is_host) {
                 context.setBalanceInfo(newQueue.balance_info);
             }
         } catch (error) {
@@ -193,20 +197,39 @@ export const QueuePage = () => {
         fetchAndLoadQueue();
     }, [queueName]);
 
+    useEffect(() => {
+        if (!typeaheadSearchQuery || typeaheadSearchQuery === debouncedSearchQuery) return;
+
+        // Show previously queued tracks instantly while Spotify results are debounced
+        (async () => {
+            const localResults = await searchForSong(queue.id, typeaheadSearchQuery, true);
+            // Drop local results that arrive after the query changed or Spotify results loaded
+            if (localResults.length > 0
+                && typeaheadSearchQuery === latestSearchQuery.current
+                && typeaheadSearchQuery !== spotifyResultsQuery.current) {
+                setSearchResults(localResults);
+            }
+        })();
+    }, [typeaheadSearchQuery]);
+
     useEffect(() => {
         if (!debouncedSearchQuery) {
+            spotifyResultsQuery.current = '';
             setSearchResults([]);
             return;
         }
 
         (async () => {
-            setSearchResults(await searchForSong(queue.id, debouncedSearchQuery));
+            const results = await searchForSong(queue.id, debouncedSearchQuery);
+            if (debouncedSearchQuery !== latestSearchQuery.current) return;  // query changed
+            spotifyResultsQuery.current = debouncedSearchQuery;
+            setSearchResults(results);
         })();
     }, [debouncedSearchQuery]);
 
     window.document.title = 'Mixify – Room';
-    const isQueueOwner = !!queue && queue.started_by_fpjs_visitor_id === context.visitorId;
-    const isQueueSubscriber = !!queue && queue.subscribers.find(subscriber => subscriber.fpjs_visitor_id === context.visitorId);
+    const isQueueOwner = !!queue && queue.is_host;
+    const isQueueSubscriber = !!queue && queue.is_subscriber;
     return queueLoaded ? (
         !!queue ? (
             <>
@@ -560,7 +583,7 @@ export const QueuePage = () => {
                         queue.queued_songs.filter((song) => !song.added_to_spotify_queue_on_utc).length > 0 ? (
                             <>
                                 {queue.queued_songs.filter((song) => !song.added_to_spotify_queue_on_utc).map((song, index) => {
-                                    const songUpvotedByUser = song.upvotes.find(upvotedById => upvotedById === context.visitorId);
+                                    const songUpvotedByUser = song.upvoted_by_me;
                                     return (
                                         <Paper
                                             key={`queue-song-${index}`}
@@ -651,7 +674,7 @@ export const QueuePage = () => {
                                                                 </>
                                                             </ActionIcon>
                                                         )}
-                                                        <Text miw={10}>{song.upvotes.length}</Text>
+                                                        <Text miw={10}>{song.upvote_count}</Text>
                                                     </>
                                                 </Group>
                                             </Group>
@@ -30,8 +30,8 @@ export const removeSongUpvote = async (queueTrackId, fpjsVisitorId) => {
     return execRequest(`${API_URL_BASE}/v1/queue/upvote/remove/${queueTrackId}/${fpjsVisitorId}`);
 };
 
-export const searchForSong = async (queueId, searchQuery) => {
-    return execRequest(`${API_URL_BASE}/v1/search/${queueId}/${searchQuery}`);
+export const searchForSong = async (queueId, searchQuery, localOnly = false) => {
+    return execRequest(`${API_URL_BASE}/v1/search/${queueId}/${searchQuery}${localOnly ? '?local=true' : ''}`);
 };
 
 export const addSongToQueue = async (queueId, spotifyTrackId, fpjsVisitorId) => {